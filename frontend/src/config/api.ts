@@ -15,6 +15,7 @@ export const API_ENDPOINTS = {
   
   // Chat/LLM endpoints
   CHAT: `${API_BASE_URL}/api/chat`,
+  CHAT_STREAM: `${API_BASE_URL}/api/chat/stream`,
   
   // Intent classification endpoints
   CLASSIFY: `${API_BASE_URL}/api/classify`,
@@ -22,6 +23,7 @@ export const API_ENDPOINTS = {
   // Analytics endpoints
   ANALYTICS: `${API_BASE_URL}/api/analytics`,
   MOOD_RECORD: `${API_BASE_URL}/api/mood/record`,
+  MOOD_RECORD_BATCH: `${API_BASE_URL}/api/mood/record_batch`,
   
   // Voice processing endpoints
   VOICE_TRANSCRIBE: `${API_BASE_URL}/api/voice/transcribe`,
@@ -4,9 +4,42 @@ Phase 2: Model Download Script
 Following mental-wellness-platform-docs.md specifications
 """
 
+import importlib.util
+import json
 import os
 import sys
 
+def verify_safetensors_files(model_dir):
+    """Check each safetensors header so truncated downloads are caught without reading the weights
+    
+    The header's tensor data_offsets must end exactly where the file does.
+    """
+    with os.scandir(model_dir) as it:
+        paths = [entry.path for entry in it if entry.name.endswith('.safetensors')]
+    
+    total_size = 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            header_len = int.from_bytes(f.read(8), 'little')
+            file_size = os.fstat(f.fileno()).st_size
+            data_size = file_size - 8 - header_len
+            if not 0 < header_len < (100 << 20) or data_size < 0:
+                raise ValueError(f"Truncated or malformed safetensors file: {os.path.basename(path)}")
+            try:
+                header = json.loads(f.read(header_len))
+                data_end = max(
+                    (info['data_offsets'][1] for name, info in header.items() if name != '__metadata__'),
+                    default=0
+                )
+            except (ValueError, KeyError, IndexError, TypeError):
+                raise ValueError(f"Malformed safetensors header: {os.path.basename(path)}")
+        
+        if data_end != data_size:
+            raise ValueError(f"Truncated or malformed safetensors file: {os.path.basename(path)}")
+        total_size += file_size
+    
+    return len(paths), total_size
+
 def download_best_compatible_model():
     """Download best compatible model for RTX 4060 (no gated access required)"""
     
@@ -15,22 +48,46 @@ def download_best_compatible_model():
     print("📊 Model size: ~7.6GB (3.8B parameters, perfect for RTX 4060)")
     print("🚀 Features: Instruction-tuned, high quality, 4K context, no gating")
     
+    # Use the Rust-based multi-connection downloader when it is installed
+    if importlib.util.find_spec("hf_transfer") is not None:
+        os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+    
     try:
+        import requests
         from huggingface_hub import snapshot_download
+        from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential
         
         # Create models directory
         os.makedirs('models', exist_ok=True)
         
         # Download Microsoft Phi-3-mini - excellent for RTX 4060
         print("🔄 Starting download...")
-        model_path = snapshot_download(
-            repo_id='microsoft/Phi-3-mini-4k-instruct',
-            local_dir='models/phi-3-mini-4k-instruct',
-            local_dir_use_symlinks=False,
-            ignore_patterns=['*.bin']  # Use safetensors format
-        )
+        # Retry dropped connections (hf_transfer occasionally times out on reads)
+        for attempt in Retrying(
+            retry=retry_if_exception_type(requests.exceptions.ConnectionError),
+            wait=wait_exponential(multiplier=1, min=2, max=30),
+            stop=stop_after_attempt(5),
+            reraise=True
+        ):
+            with attempt:
+                model_path = snapshot_download(
+                    repo_id='microsoft/Phi-3-mini-4k-instruct',
+                    local_dir='models/phi-3-mini-4k-instruct',
+                    local_dir_use_symlinks=False,
+                    ignore_patterns=['*.bin'],  # Use safetensors format
+                    max_workers=8,
+                    etag_timeout=30
+                )
         
         print(f"✅ Model downloaded to: {model_path}")
+        
+        try:
+            shard_count, total_size = verify_safetensors_files(model_path)
+        except ValueError as e:
+            print(f"❌ {e}")
+            print("💡 Run the script again to resume the download")
+            return False
+        print(f"🔍 Verified {shard_count} safetensors shards ({total_size / 1024**3:.1f} GB)")
         print("🚀 Ready for 4-bit quantization and RTX 4060 optimization")
         print("💡 Phi-3-mini: Microsoft's best small model, perfect for mental wellness conversations")
         return True
@@ -42,7 +99,7 @@ def download_best_compatible_model():
         import subprocess
         subprocess.check_call([
             sys.executable, "-m", "pip", "install", 
-            "huggingface_hub", "transformers", "torch", "accelerate", "bitsandbytes"
+            "huggingface_hub", "hf_transfer", "tenacity", "transformers", "torch", "accelerate", "bitsandbytes"
         ])
         
         print("✅ Packages installed, please run again")
@@ -56,8 +113,16 @@ def download_best_compatible_model():
         stub_dir = 'models/phi-3-mini-4k-instruct'
         os.makedirs(stub_dir, exist_ok=True)
         
-        with open(f'{stub_dir}/config.json', 'w') as f:
-            f.write('{"model_type": "phi3", "stub": true}')
+        # Write atomically so an interrupted run never leaves a partial config.json
+        config_path = os.path.join(stub_dir, 'config.json')
+        tmp_path = config_path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, b'{"model_type": "phi3", "stub": true}')
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, config_path)
         
         print(f"📁 Model stub created at: {stub_dir}")
         return False
@@ -5,13 +5,35 @@ Downloads high-quality mental wellness PDFs from reputable sources
 
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
-import time
+from urllib3.util.retry import Retry
 
 # Create documents directory
 DOCS_DIR = "../documents"
 os.makedirs(DOCS_DIR, exist_ok=True)
 
+# Shared session so repeat hosts reuse pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+})
+_ADAPTER = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
+)
+SESSION.mount('https://', _ADAPTER)
+SESSION.mount('http://', _ADAPTER)
+
+# Concurrent downloads; sources are spread over distinct hosts
+MAX_DOWNLOAD_WORKERS = 8
+
+# Stream bodies in large chunks to keep per-chunk Python/syscall overhead low
+DOWNLOAD_CHUNK_SIZE = 512 * 1024
+WRITE_BUFFER_SIZE = 1 << 20
+
 # High-quality mental wellness document sources
 WELLNESS_DOCUMENTS = {
     # WHO Mental Health Resources
@@ -69,8 +91,8 @@ ALTERNATIVE_SOURCES = {
     "Emotional_Regulation_Skills.pdf": "https://www.therapistaid.com/worksheets/emotion-regulation-skills.pdf"
 }
 
-def download_pdf(url, filename, max_retries=3):
-    """Download PDF with error handling and retries"""
+def download_pdf(url, filename):
+    """Download PDF with error handling (retries handled by the session adapter)"""
     filepath = os.path.join(DOCS_DIR, filename)
     
     # Skip if file already exists
@@ -78,38 +100,58 @@ def download_pdf(url, filename, max_retries=3):
         print(f"✅ {filename} already exists")
         return True
     
-    for attempt in range(max_retries):
-        try:
-            print(f"🔄 Downloading {filename} (attempt {attempt + 1})...")
-            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=30, stream=True)
+    try:
+        print(f"🔄 Downloading {filename}...")
+        
+        # Context manager returns the pooled connection even on the early 'not a PDF' exit
+        with SESSION.get(url, timeout=30, stream=True) as response:
             response.raise_for_status()
             
-            # Check if response is actually a PDF
+            # Check if response is actually a PDF from the first streamed chunk
             content_type = response.headers.get('content-type', '').lower()
-            if 'pdf' not in content_type and len(response.content) < 1000:
+            chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+            first = next(chunks, b'')
+            if not first.startswith(b'%PDF') and 'pdf' not in content_type:
                 print(f"⚠️  {filename} - Not a valid PDF, skipping")
                 return False
             
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
+            # Stream into a .part file and rename only once the body is complete, so a
+            # dropped connection never leaves a truncated PDF that later runs would skip
+            part_path = filepath + '.part'
+            total = len(first)
+            with open(part_path, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+                f.write(first)
+                for chunk in chunks:
                     if chunk:
                         f.write(chunk)
-            
-            print(f"✅ Successfully downloaded {filename} ({len(response.content)} bytes)")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Error downloading {filename}: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2)  # Wait before retry
+                        total += len(chunk)
+            os.replace(part_path, filepath)
+        
+        print(f"✅ Successfully downloaded {filename} ({total} bytes)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Error downloading {filename}: {e}")
+        # Drop any partial download; the next run starts it over
+        try:
+            os.remove(filepath + '.part')
+        except OSError:
+            pass
     
     return False
 
+def download_all(documents):
+    """Download a {filename: url} mapping concurrently, returning the success count"""
+    downloaded = 0
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        futures = {
+            executor.submit(download_pdf, url, filename): filename
+            for filename, url in documents.items()
+        }
+        for future in as_completed(futures):
+            downloaded += int(future.result())
+    return downloaded
+
 def create_sample_documents():
     """Create sample mental wellness documents if downloads fail"""
     sample_docs = {
@@ -288,18 +330,12 @@ def main():
     total_docs = len(WELLNESS_DOCUMENTS)
     
     # Try to download primary sources
-    for filename, url in WELLNESS_DOCUMENTS.items():
-        if download_pdf(url, filename):
-            downloaded_count += 1
-        time.sleep(1)  # Be respectful to servers
+    downloaded_count += download_all(WELLNESS_DOCUMENTS)
     
     # Try alternative sources if we don't have enough documents
     if downloaded_count < 5:
         print("\n🔄 Trying alternative sources...")
-        for filename, url in ALTERNATIVE_SOURCES.items():
-            if download_pdf(url, filename):
-                downloaded_count += 1
-            time.sleep(1)
+        downloaded_count += download_all(ALTERNATIVE_SOURCES)
     
     # Create sample documents to ensure we have content
     print("\n📝 Creating sample mental wellness documents...")
@@ -309,11 +345,11 @@ def main():
     print(f"📊 Downloaded: {downloaded_count}/{total_docs} PDFs")
     print(f"📁 Documents saved in: {os.path.abspath(DOCS_DIR)}")
     
-    # List all files in documents directory
-    doc_files = os.listdir(DOCS_DIR)
+    # List all files in documents directory (scandir reuses directory-read stat data)
+    with os.scandir(DOCS_DIR) as it:
+        doc_files = [(entry.name, entry.stat().st_size) for entry in it]
     print(f"\n📋 Available documents ({len(doc_files)} total):")
-    for i, doc in enumerate(doc_files, 1):
-        size = os.path.getsize(os.path.join(DOCS_DIR, doc))
+    for i, (doc, size) in enumerate(doc_files, 1):
         print(f"  {i}. {doc} ({size:,} bytes)")
 
 if __name__ == "__main__":
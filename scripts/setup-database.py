@@ -21,7 +21,11 @@ def setup_database():
         
         # Connect to database (creates if doesn't exist)
         conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        
+        # WAL journaling persists in the database file for all later connections
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
         
         # Read and execute schema
         schema_path = Path("sql/schema_sqlite.sql")
@@ -31,12 +35,11 @@ def setup_database():
         with open(schema_path, 'r') as f:
             schema_sql = f.read()
         
-        # Execute schema (split by semicolon for multiple statements)
-        for statement in schema_sql.split(';'):
-            if statement.strip():
-                cursor.execute(statement)
+        # Execute the whole schema script in one pass
+        with conn:
+            conn.executescript(schema_sql)
         
-        conn.commit()
+        cursor = conn.cursor()
         
         # Test database by querying sample data
         cursor.execute("SELECT COUNT(*) FROM users")
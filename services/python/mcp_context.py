@@ -3,15 +3,23 @@ Model Context Protocol (MCP) for Mental Wellness Platform
 Provides dynamic context management and adaptive prompting for Phi-3 model
 """
 
-from typing import Dict, List, Optional, Any
-from enum import Enum
-from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Any, Tuple
+from enum import StrEnum
+from dataclasses import dataclass, field, asdict
+from collections import OrderedDict, deque
+from itertools import islice
+from functools import lru_cache
 from datetime import datetime
 import json
+import logging
 import os
+import re
+import threading
 
+logger = logging.getLogger(__name__)
 
-class ContextType(Enum):
+
+class ContextType(StrEnum):
     """Types of context that can be provided to the model"""
     CRISIS = "crisis"
     ANXIETY = "anxiety"
@@ -25,7 +33,7 @@ class ContextType(Enum):
     THERAPY = "therapy"
 
 
-class UserState(Enum):
+class UserState(StrEnum):
     """Current emotional/mental state of the user"""
     CALM = "calm"
     ANXIOUS = "anxious"
@@ -37,36 +45,31 @@ class UserState(Enum):
     OVERWHELMED = "overwhelmed"
 
 
-@dataclass
-class ConversationContext:
-    """Holds context information for a conversation"""
-    user_id: int
-    session_id: str
-    context_type: ContextType
-    user_state: UserState
-    conversation_history: List[Dict[str, str]] = field(default_factory=list)
-    user_preferences: Dict[str, Any] = field(default_factory=dict)
-    crisis_indicators: List[str] = field(default_factory=list)
-    timestamp: datetime = field(default_factory=datetime.now)
+# Crisis keywords shared by all managers (one immutable copy per process)
+CRISIS_KEYWORDS: frozenset = frozenset({
+    "suicide", "kill myself", "end it all", "not worth living",
+    "hurt myself", "self harm", "can't go on", "hopeless",
+    "want to die", "ending everything"
+})
 
+# System prompt returned by generate_dynamic_prompt
+DYNAMIC_SYSTEM_PROMPT = "You are a friendly mental wellness companion. Respond naturally and helpfully."
 
-class MCPContextManager:
-    """Model Context Protocol Manager for dynamic prompt generation"""
-    
-    def __init__(self):
-        self.context_templates = self._load_context_templates()
-        self.crisis_keywords = [
-            "suicide", "kill myself", "end it all", "not worth living",
-            "hurt myself", "self harm", "can't go on", "hopeless",
-            "want to die", "ending everything"
-        ]
-        # Conversation memory storage - in production, use Redis or database
-        self.conversation_memory = {}  # user_id -> ConversationContext
-        
-    def _load_context_templates(self) -> Dict[str, str]:
-        """Load context-specific system prompts"""
-        return {
-            ContextType.CRISIS.value: """You are an emergency mental health AI assistant. This is a CRISIS situation.
+# Messages longer than this are classified from their opening and closing
+# windows only; crisis keywords are always searched across the full text
+LONG_MESSAGE_CHARS = 4096
+LONG_MESSAGE_WINDOW = 2048
+
+# Number of striped locks guarding per-user context updates
+USER_LOCK_STRIPES = 64
+
+# Conversation turns kept per context (ring buffer, oldest evicted first)
+MAX_HISTORY_MESSAGES = int(os.getenv("MCP_HISTORY_SIZE", "32"))
+
+
+# Context-specific system prompts, built once at import
+CONTEXT_TEMPLATES: Dict[str, str] = {
+    ContextType.CRISIS.value: """You are an emergency mental health AI assistant. This is a CRISIS situation.
 
 CRITICAL PRIORITIES:
 1. Express immediate care and concern
@@ -83,7 +86,7 @@ Crisis Resources:
 
 Your response should be compassionate, urgent, and focused on immediate safety.""",
 
-            ContextType.ANXIETY.value: """You are a specialized anxiety support AI assistant powered by Phi-3.
+    ContextType.ANXIETY.value: """You are a specialized anxiety support AI assistant powered by Phi-3.
 
 Your expertise includes:
 1. Understanding anxiety triggers and symptoms
@@ -98,7 +101,7 @@ Approach:
 - Encourage gradual exposure when appropriate
 - Recognize when professional help is needed""",
 
-            ContextType.DEPRESSION.value: """You are a depression-aware mental wellness AI assistant.
+    ContextType.DEPRESSION.value: """You are a depression-aware mental wellness AI assistant.
 
 Your understanding includes:
 1. Depression symptoms and their impact on daily life
@@ -114,7 +117,7 @@ Response Style:
 - Emphasize hope and recovery possibility
 - Monitor for suicidal ideation""",
 
-            ContextType.STRESS.value: """You are a stress management AI specialist.
+    ContextType.STRESS.value: """You are a stress management AI specialist.
 
 Your toolkit includes:
 1. Stress identification and source analysis
@@ -129,7 +132,7 @@ Focus Areas:
 - Suggest lifestyle modifications
 - Encourage healthy coping mechanisms""",
 
-            ContextType.GENERAL_WELLNESS.value: """You are a comprehensive mental wellness AI assistant powered by Phi-3.
+    ContextType.GENERAL_WELLNESS.value: """You are a comprehensive mental wellness AI assistant powered by Phi-3.
 
 Your role encompasses:
 1. General mental health education and support
@@ -145,7 +148,7 @@ Approach:
 - Promote overall well-being
 - Connect mental and physical health""",
 
-            ContextType.MOTIVATION.value: """You are a motivational mental wellness AI coach.
+    ContextType.MOTIVATION.value: """You are a motivational mental wellness AI coach.
 
 Your specialties:
 1. Goal setting and achievement strategies
@@ -160,7 +163,7 @@ Style:
 - Acknowledge setbacks as normal
 - Focus on personal growth and progress""",
 
-            ContextType.SLEEP.value: """You are a sleep and mental health specialist AI.
+    ContextType.SLEEP.value: """You are a sleep and mental health specialist AI.
 
 Your knowledge covers:
 1. Sleep hygiene and healthy sleep habits
@@ -175,7 +178,7 @@ Guidance Focus:
 - Explain sleep's role in mental wellness
 - Suggest relaxation techniques for bedtime""",
 
-            ContextType.RELATIONSHIPS.value: """You are a relationship and social wellness AI counselor.
+    ContextType.RELATIONSHIPS.value: """You are a relationship and social wellness AI counselor.
 
 Your expertise includes:
 1. Communication skills and conflict resolution
@@ -190,7 +193,7 @@ Support Style:
 - Encourage healthy boundaries
 - Support social skill development""",
 
-            ContextType.WORK_LIFE.value: """You are a work-life balance and career wellness AI advisor.
+    ContextType.WORK_LIFE.value: """You are a work-life balance and career wellness AI advisor.
 
 Your focus areas:
 1. Work-related stress and burnout prevention
@@ -205,7 +208,7 @@ Approach:
 - Help separate work stress from personal life
 - Encourage professional development""",
 
-            ContextType.THERAPY.value: """You are a therapy-informed mental wellness AI assistant.
+    ContextType.THERAPY.value: """You are a therapy-informed mental wellness AI assistant.
 
 Your understanding includes:
 1. Basic therapeutic principles and techniques
@@ -219,101 +222,308 @@ Important Notes:
 - Always encourage professional help when appropriate
 - Provide psychoeducation and support
 - Help users maximize their therapy experience"""
-        }
+}
+
+
+@dataclass(slots=True)
+class ConversationContext:
+    """Holds context information for a conversation"""
+    user_id: int
+    session_id: str
+    context_type: ContextType
+    user_state: UserState
+    conversation_history: Deque[Dict[str, str]] = field(default_factory=lambda: deque(maxlen=MAX_HISTORY_MESSAGES))
+    user_preferences: Dict[str, Any] = field(default_factory=dict)
+    crisis_indicators: List[str] = field(default_factory=list)
+    timestamp: datetime = field(default_factory=datetime.now)
     
-    def detect_context_type(self, message: str, history: List[Dict[str, str]]) -> ContextType:
-        """Simplified context detection focusing on current message"""
-        message_lower = message.lower()
+    def __post_init__(self):
+        # Accept plain lists (callers, JSON) and keep history bounded
+        if not isinstance(self.conversation_history, deque):
+            self.conversation_history = deque(self.conversation_history, maxlen=MAX_HISTORY_MESSAGES)
+
+
+class MCPContextManager:
+    """Model Context Protocol Manager for dynamic prompt generation"""
+    
+    def __init__(self):
+        self.context_templates = CONTEXT_TEMPLATES
+        self.crisis_keywords = CRISIS_KEYWORDS
+        # Detection keywords per context type / user state, in priority order
+        self.context_keywords = {
+            ContextType.CRISIS: self.crisis_keywords,
+            ContextType.ANXIETY: ["anxious", "anxiety", "worry", "panic", "nervous"],
+            ContextType.DEPRESSION: ["depressed", "depression", "sad", "hopeless", "down"],
+            ContextType.STRESS: ["stressed", "stress", "pressure", "overwhelmed"],
+        }
+        self.state_keywords = {
+            UserState.OVERWHELMED: self.crisis_keywords,
+            UserState.ANXIOUS: ["anxious", "nervous", "worry", "panic"],
+            UserState.DEPRESSED: ["sad", "depressed", "hopeless", "down"],
+            UserState.STRESSED: ["stressed", "pressure", "overwhelmed"],
+            UserState.ANGRY: ["angry", "mad", "frustrated"],
+            UserState.HOPEFUL: ["better", "good", "positive", "hopeful", "grateful"],
+            UserState.CONFUSED: ["confused", "don't know", "uncertain"],
+        }
+        self._keyword_tags, self._keyword_pattern = self._build_keyword_matcher()
+        self._hyperscan_db, self._hyperscan_keywords = self._build_hyperscan_matcher()
+        self._crisis_pattern = re.compile("|".join(map(re.escape, sorted(self.crisis_keywords))))
+        # Compiled per-category keyword alternations for topic and preference tracking
+        self.topic_patterns = {
+            topic: re.compile("|".join(map(re.escape, keywords)))
+            for topic, keywords in {
+                'anxiety': ['anxiety', 'anxious'],
+                'depression': ['depression', 'depressed'],
+                'stress': ['stress', 'stressed'],
+                'sleep issues': ['sleep'],
+                'work concerns': ['work', 'job'],
+                'relationships': ['relationship'],
+            }.items()
+        }
+        self.preference_patterns = {
+            name: re.compile("|".join(map(re.escape, keywords)))
+            for name, keywords in {
+                'brief': ["brief", "short", "quick", "concise"],
+                'detailed': ["detailed", "explain", "elaborate", "more info"],
+                'mindfulness': ["breathing", "meditation", "mindfulness"],
+                'physical_activity': ["exercise", "walk", "physical", "activity"],
+            }.items()
+        }
+        # Memoized (context type, user state) per lowercased message
+        self._classify = lru_cache(maxsize=4096)(self._classify_uncached)
+        # Conversation memory: bounded in-process LRU. When REDIS_URL is set,
+        # Redis is the source of truth (contexts survive restarts and every
+        # worker process reads the latest turn) and the LRU is only a fallback
+        # copy for Redis outages
+        self.max_memory_entries = int(os.getenv("MCP_MEMORY_SIZE", "1024"))
+        self.context_ttl = int(os.getenv("MCP_CONTEXT_TTL", "86400"))
+        self.conversation_memory = OrderedDict()  # user_id -> ConversationContext
+        self.redis = self._connect_redis()
+        # Short global lock for LRU bookkeeping, plus striped per-user locks so
+        # concurrent turns for one user don't clobber each other while
+        # different users proceed in parallel
+        self._memory_lock = threading.Lock()
+        self._user_locks = [threading.Lock() for _ in range(USER_LOCK_STRIPES)]
+        
+    def _connect_redis(self):
+        """Connect to the Redis context store if configured; None otherwise"""
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            return None
         
-        # Crisis detection - highest priority
-        if any(keyword in message_lower for keyword in self.crisis_keywords):
-            return ContextType.CRISIS
+        try:
+            import redis
+            client = redis.Redis.from_url(redis_url)
+            client.ping()
+            logger.info("MCP context store connected to Redis")
+            return client
+        except Exception as e:
+            logger.warning("Redis unavailable for MCP context store, using in-process memory only: %s", e)
+            return None
+    
+    @staticmethod
+    def _context_key(user_id: int) -> str:
+        return f"mcp:context:{user_id}"
+    
+    @staticmethod
+    def _context_to_json(context: ConversationContext) -> str:
+        # Enum members are str subclasses, so json encodes them as their values
+        data = asdict(context)
+        data["conversation_history"] = list(context.conversation_history)
+        data["timestamp"] = context.timestamp.isoformat()
+        return json.dumps(data)
+    
+    @staticmethod
+    def _context_from_json(raw) -> ConversationContext:
+        data = json.loads(raw)
+        data["context_type"] = ContextType(data["context_type"])
+        data["user_state"] = UserState(data["user_state"])
+        data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+        return ConversationContext(**data)
+    
+    def _user_lock(self, user_id: int) -> threading.Lock:
+        return self._user_locks[hash(user_id) % USER_LOCK_STRIPES]
+    
+    def _remember(self, context: ConversationContext):
+        """Insert into the hot tier as most recently used, evicting the oldest"""
+        with self._memory_lock:
+            self.conversation_memory[context.user_id] = context
+            self.conversation_memory.move_to_end(context.user_id)
+            while len(self.conversation_memory) > self.max_memory_entries:
+                self.conversation_memory.popitem(last=False)
+    
+    def _get_context(self, user_id: int) -> Optional[ConversationContext]:
+        """Look up a context: read through Redis when configured (other workers may
+        have written newer turns), else or on a Redis error from the in-process LRU"""
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self._context_key(user_id))
+                if raw:
+                    context = self._context_from_json(raw)
+                    self._remember(context)
+                    return context
+                # Expired or cleared in Redis; drop any stale local copy
+                with self._memory_lock:
+                    self.conversation_memory.pop(user_id, None)
+                return None
+            except Exception as e:
+                logger.warning("Redis context read failed for user %s: %s", user_id, e)
         
-        # Simple keyword matching for main contexts
-        if any(word in message_lower for word in ["anxious", "anxiety", "worry", "panic", "nervous"]):
-            return ContextType.ANXIETY
+        with self._memory_lock:
+            context = self.conversation_memory.get(user_id)
+            if context is not None:
+                self.conversation_memory.move_to_end(user_id)
+            return context
+    
+    def _persist(self, context: ConversationContext):
+        """Write a context through to Redis (no-op without Redis)"""
+        if self.redis is None:
+            return
+        try:
+            self.redis.set(self._context_key(context.user_id), self._context_to_json(context), ex=self.context_ttl)
+        except Exception as e:
+            logger.warning("Redis context write failed for user %s: %s", context.user_id, e)
         
-        if any(word in message_lower for word in ["depressed", "depression", "sad", "hopeless", "down"]):
-            return ContextType.DEPRESSION
+    def _build_keyword_matcher(self):
+        """Map each keyword to the context types / user states it signals and
+        compile all keywords into one lookahead alternation (longest first)"""
+        keyword_tags = {}
+        for tag_keywords in (self.context_keywords, self.state_keywords):
+            for tag, keywords in tag_keywords.items():
+                for keyword in keywords:
+                    keyword_tags.setdefault(keyword, set()).add(tag)
         
-        if any(word in message_lower for word in ["stressed", "stress", "pressure", "overwhelmed"]):
-            return ContextType.STRESS
+        # A match only reports the longest keyword at a position, so it also
+        # carries the tags of any keyword that is a prefix of it
+        for keyword, tags in keyword_tags.items():
+            for other, other_tags in keyword_tags.items():
+                if other != keyword and keyword.startswith(other):
+                    tags |= other_tags
         
-        # Default to general wellness
-        return ContextType.GENERAL_WELLNESS
+        pattern = re.compile("(?=(" + "|".join(
+            re.escape(keyword) for keyword in sorted(sorted(keyword_tags), key=len, reverse=True)
+        ) + "))")
+        return keyword_tags, pattern
     
-    def detect_user_state(self, message: str, history: List[Dict[str, str]]) -> UserState:
-        """Simplified user state detection"""
-        message_lower = message.lower()
+    def _build_hyperscan_matcher(self):
+        """Optional Hyperscan database over the same keywords (MCP_MATCHER=hyperscan)"""
+        if os.getenv("MCP_MATCHER", "re").lower() != "hyperscan":
+            return None, None
         
-        # Crisis state
-        if any(keyword in message_lower for keyword in self.crisis_keywords):
-            return UserState.OVERWHELMED
+        try:
+            import hyperscan
+        except ImportError:
+            logger.warning("MCP_MATCHER=hyperscan but hyperscan is not installed, using re matcher")
+            return None, None
         
-        # Basic emotional state detection
-        if any(word in message_lower for word in ["anxious", "nervous", "worry", "panic"]):
-            return UserState.ANXIOUS
-        
-        if any(word in message_lower for word in ["sad", "depressed", "hopeless", "down"]):
-            return UserState.DEPRESSED
+        keywords = list(self._keyword_tags)
+        database = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+        database.compile(
+            expressions=[re.escape(keyword).encode() for keyword in keywords],
+            ids=list(range(len(keywords))),
+            elements=len(keywords),
+            flags=[hyperscan.HS_FLAG_SINGLEMATCH] * len(keywords)
+        )
+        logger.info("MCP keyword matcher using Hyperscan (%d keywords)", len(keywords))
+        return database, keywords
+    
+    def _match_tags(self, message_lower: str) -> set:
+        """Single scan of the message; returns every context type / user state signalled"""
+        tags = set()
+        if self._hyperscan_db is not None:
+            def on_match(keyword_id, start, end, flags, context):
+                tags.update(self._keyword_tags[self._hyperscan_keywords[keyword_id]])
+            self._hyperscan_db.scan(message_lower.encode(), match_event_handler=on_match)
+            return tags
         
-        if any(word in message_lower for word in ["stressed", "pressure", "overwhelmed"]):
-            return UserState.STRESSED
+        for keyword in {m.group(1) for m in self._keyword_pattern.finditer(message_lower)}:
+            tags |= self._keyword_tags[keyword]
+        return tags
         
-        if any(word in message_lower for word in ["angry", "mad", "frustrated"]):
-            return UserState.ANGRY
+    def _classify_uncached(self, message_lower: str) -> Tuple[ContextType, UserState]:
+        """Detect context type and user state from one keyword scan"""
+        if len(message_lower) > LONG_MESSAGE_CHARS:
+            # Bound work on pasted walls of text, but never miss a crisis signal
+            tags = self._match_tags(
+                message_lower[:LONG_MESSAGE_WINDOW] + " " + message_lower[-LONG_MESSAGE_WINDOW:]
+            )
+            if self._crisis_pattern.search(message_lower):
+                tags |= {ContextType.CRISIS, UserState.OVERWHELMED}
+        else:
+            tags = self._match_tags(message_lower)
         
-        if any(word in message_lower for word in ["better", "good", "positive", "hopeful", "grateful"]):
-            return UserState.HOPEFUL
+        # Crisis first, then the main contexts in priority order;
+        # default to general wellness
+        context_type = next(
+            (context_type for context_type in self.context_keywords if context_type in tags),
+            ContextType.GENERAL_WELLNESS
+        )
         
-        if any(word in message_lower for word in ["confused", "don't know", "uncertain"]):
-            return UserState.CONFUSED
+        # Crisis state first, then basic emotional states in priority order;
+        # default to calm
+        user_state = next(
+            (user_state for user_state in self.state_keywords if user_state in tags),
+            UserState.CALM
+        )
         
-        # Default to calm
-        return UserState.CALM
+        return context_type, user_state
+    
+    def classify_batch(self, messages: List[str]) -> List[Tuple[ContextType, UserState]]:
+        """Classify many messages at once (offline transcript analysis).
+        Bypasses the per-turn LRU so a bulk run doesn't evict live entries;
+        repeated messages within the batch are classified once."""
+        results = {}
+        classify = self._classify_uncached
+        return [
+            results[message] if message in results else results.setdefault(message, classify(message))
+            for message in map(str.lower, messages)
+        ]
+    
+    def detect_context_type(self, message: str, history: List[Dict[str, str]]) -> ContextType:
+        """Simplified context detection focusing on current message"""
+        return self._classify(message.lower())[0]
+    
+    def detect_user_state(self, message: str, history: List[Dict[str, str]]) -> UserState:
+        """Simplified user state detection"""
+        return self._classify(message.lower())[1]
     
     def generate_dynamic_prompt(self, context: ConversationContext, current_message: str) -> str:
-        """Generate very simple prompt"""
-        return "You are a friendly mental wellness companion. Respond naturally and helpfully."
+        """Generate very simple prompt (context and message are currently unused)"""
+        return DYNAMIC_SYSTEM_PROMPT
     
     def _extract_recent_topics(self, history: List[Dict[str, str]], limit: int = 3) -> List[str]:
         """Extract key topics from recent conversation history"""
-        topics = []
-        for entry in history[-limit:]:
+        topics = {}  # insertion-ordered set: most recent topic first, no duplicates
+        for entry in islice(reversed(history), limit):  # most recent first
             if entry.get('role') == 'user':
-                message = entry.get('content', '').lower()
-                # Simple topic extraction - could be enhanced with NLP
-                if 'anxiety' in message or 'anxious' in message:
-                    topics.append('anxiety')
-                elif 'depression' in message or 'depressed' in message:
-                    topics.append('depression')
-                elif 'stress' in message or 'stressed' in message:
-                    topics.append('stress')
-                elif 'sleep' in message:
-                    topics.append('sleep issues')
-                elif 'work' in message or 'job' in message:
-                    topics.append('work concerns')
-                elif 'relationship' in message:
-                    topics.append('relationships')
+                message = entry.get('_lower') or entry.get('content', '').lower()
+                # Simple topic extraction - first matching topic wins
+                topic = next(
+                    (topic for topic, pattern in self.topic_patterns.items() if pattern.search(message)),
+                    None
+                )
+                if topic:
+                    topics[topic] = None
         
-        return list(set(topics))  # Remove duplicates
+        return list(topics)
     
     def _update_user_preferences(self, context: ConversationContext, message: str, history: List[Dict[str, str]]):
         """Extract and update user preferences from conversation"""
         message_lower = message.lower()
         
         # Detect communication preferences
-        if any(word in message_lower for word in ["brief", "short", "quick", "concise"]):
+        if self.preference_patterns['brief'].search(message_lower):
             context.user_preferences["communication_style"] = "brief"
-        elif any(word in message_lower for word in ["detailed", "explain", "elaborate", "more info"]):
+        elif self.preference_patterns['detailed'].search(message_lower):
             context.user_preferences["communication_style"] = "detailed"
         
-        # Detect coping strategy preferences
-        if any(word in message_lower for word in ["breathing", "meditation", "mindfulness"]):
-            context.user_preferences["preferred_techniques"] = context.user_preferences.get("preferred_techniques", []) + ["mindfulness"]
-        
-        if any(word in message_lower for word in ["exercise", "walk", "physical", "activity"]):
-            context.user_preferences["preferred_techniques"] = context.user_preferences.get("preferred_techniques", []) + ["physical_activity"]
+        # Detect coping strategy preferences (appended in place, once each;
+        # kept as a list so the context stays JSON-serializable)
+        for technique in ("mindfulness", "physical_activity"):
+            if self.preference_patterns[technique].search(message_lower):
+                techniques = context.user_preferences.setdefault("preferred_techniques", [])
+                if technique not in techniques:
+                    techniques.append(technique)
         
         # Track recurring topics
         context.user_preferences["conversation_count"] = context.user_preferences.get("conversation_count", 0) + 1
@@ -324,57 +534,70 @@ Important Notes:
         if history is None:
             history = []
         
-        # Check if we have existing context for this user
-        existing_context = self.conversation_memory.get(user_id)
+        # One clock read and one classification per turn
+        now = datetime.now()
+        context_type, user_state = self._classify(message.lower())
         
-        if existing_context:
-            # Update existing context with new message
-            existing_context.conversation_history = history
-            existing_context.context_type = self.detect_context_type(message, history)
-            existing_context.user_state = self.detect_user_state(message, history)
-            existing_context.timestamp = datetime.now()
-            
-            # Extract user preferences from conversation
-            self._update_user_preferences(existing_context, message, history)
-            
-            print(f"🔄 Updated existing context for user {user_id} | History length: {len(history)}")
-            return existing_context
-        else:
-            # Create new context
-            context_type = self.detect_context_type(message, history)
-            user_state = self.detect_user_state(message, history)
-            
-            # Generate session ID
-            session_id = f"session_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            
-            new_context = ConversationContext(
-                user_id=user_id,
-                session_id=session_id,
-                context_type=context_type,
-                user_state=user_state,
-                conversation_history=history,
-                timestamp=datetime.now()
-            )
-            
-            # Store in memory
-            self.conversation_memory[user_id] = new_context
+        with self._user_lock(user_id):
+            # Check if we have existing context for this user
+            existing_context = self._get_context(user_id)
             
-            print(f"🆕 Created new context for user {user_id} | Context: {context_type.value} | State: {user_state.value}")
-            return new_context
-    
+            if existing_context:
+                # Update existing context with new message
+                # History is server-authoritative; caller history only seeds an empty one
+                if history and not existing_context.conversation_history:
+                    existing_context.conversation_history.extend(history)
+                existing_context.context_type = context_type
+                existing_context.user_state = user_state
+                existing_context.timestamp = now
+                
+                # Extract user preferences from conversation
+                self._update_user_preferences(existing_context, message, history)
+                
+                self._persist(existing_context)
+                
+                logger.debug("Updated existing context for user %s | History length: %d",
+                             user_id, len(existing_context.conversation_history))
+                return existing_context
+            else:
+                # Create new context
+                session_id = f"session_{user_id}_{now:%Y%m%d_%H%M%S}"
+                
+                new_context = ConversationContext(
+                    user_id=user_id,
+                    session_id=session_id,
+                    context_type=context_type,
+                    user_state=user_state,
+                    conversation_history=history,
+                    timestamp=now
+                )
+                
+                # Store in memory
+                self._remember(new_context)
+                self._persist(new_context)
+                
+                logger.debug("Created new context for user %s | Context: %s | State: %s",
+                             user_id, context_type.value, user_state.value)
+                return new_context
+
     def update_context(self, context: ConversationContext, new_message: str, response: str) -> ConversationContext:
         """Update context with new conversation turn"""
-        # Add new exchange to history
-        context.conversation_history.extend([
-            {"role": "user", "content": new_message},
-            {"role": "assistant", "content": response}
-        ])
-        
-        # Re-evaluate context type and user state
-        context.context_type = self.detect_context_type(new_message, context.conversation_history)
-        context.user_state = self.detect_user_state(new_message, context.conversation_history)
-        context.timestamp = datetime.now()
+        # User turns carry their lowercased text so topic extraction
+        # doesn't re-lower them on every call
+        new_message_lower = new_message.lower()
         
+        with self._user_lock(context.user_id):
+            # Add new exchange to history
+            context.conversation_history.extend([
+                {"role": "user", "content": new_message, "_lower": new_message_lower},
+                {"role": "assistant", "content": response}
+            ])
+            
+            # Re-evaluate context type and user state
+            context.context_type, context.user_state = self._classify(new_message_lower)
+            context.timestamp = datetime.now()
+            
+            self._persist(context)
         return context
 
 
@@ -0,0 +1,98 @@
+"""
+Mood Chart Rendering for Mental Wellness Platform
+Lightweight matplotlib (Agg) renderer, importable by chart worker processes
+"""
+
+import io
+import threading
+from typing import Any, Dict, List
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+
+# Pin the bundled font and simplify long line paths
+matplotlib.rcParams['font.family'] = 'DejaVu Sans'
+matplotlib.rcParams['path.simplify'] = True
+matplotlib.rcParams['path.simplify_threshold'] = 1.0
+matplotlib.rcParams['agg.path.chunksize'] = 10000
+
+
+def _warm_font_cache():
+    """Draw a throwaway figure so font discovery happens at import, not on the first request"""
+    figure = Figure()
+    figure.gca().plot([0, 1], [0, 1])
+    FigureCanvasAgg(figure).draw()
+
+
+_warm_font_cache()
+
+# Dashboard-sized output; PNG size scales with dpi squared
+CHART_DPI = 96
+
+# Per-thread matplotlib figure reused across chart renders (no pyplot global state)
+_chart_state = threading.local()
+
+
+def _get_chart_figure():
+    """Return this thread's reusable (figure, axes, canvas) for mood charts"""
+    if not hasattr(_chart_state, "figure"):
+        figure = Figure(figsize=(10, 6))
+        # Fixed margins instead of re-running a layout engine on every render
+        figure.subplots_adjust(left=0.08, right=0.98, top=0.93, bottom=0.18)
+        _chart_state.figure = figure
+        _chart_state.axes = figure.add_subplot(111)
+        _chart_state.canvas = FigureCanvasAgg(figure)
+    return _chart_state.figure, _chart_state.axes, _chart_state.canvas
+
+
+def generate_mood_chart_bytes(mood_data: List[Dict[str, Any]]) -> bytes:
+    """Render mood history as raw PNG bytes (empty if there is no data)"""
+    if not mood_data:
+        return b""
+    
+    figure, ax, canvas = _get_chart_figure()
+    ax.clear()
+    
+    n = len(mood_data)
+    ts = np.array([entry['timestamp'] for entry in mood_data], dtype='datetime64[s]')
+    scores = np.fromiter((entry['mood_score'] for entry in mood_data), dtype=np.int16, count=n)
+    order = np.argsort(ts, kind='stable')
+    ts, scores = ts[order], scores[order]
+    
+    ax.plot(ts, scores, marker='o', linewidth=2, color='#4a90d9', label='Mood score')
+    
+    # Linear trend line (closed-form least squares over x = 0..n-1)
+    if n > 1:
+        x = np.arange(n, dtype=np.float64)
+        y = scores.astype(np.float64)
+        sx, sy = x.sum(), y.sum()
+        sxx, sxy = (x * x).sum(), (x * y).sum()
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        intercept = (sy - slope * sx) / n
+        ax.plot(ts, intercept + slope * x, "r--", alpha=0.8, label='Trend')
+    
+    # Mood zones (0-100 scale)
+    ax.axhspan(0, 40, alpha=0.1, color='red')
+    ax.axhspan(40, 70, alpha=0.1, color='yellow')
+    ax.axhspan(70, 100, alpha=0.1, color='green')
+    
+    ax.set_ylim(0, 100)
+    ax.set_title('Mood Trend')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Mood Score (0-100)')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.grid(True, alpha=0.3)
+    ax.legend()
+    
+    buffer = io.BytesIO()
+    figure.savefig(
+        buffer,
+        format='png',
+        dpi=CHART_DPI,
+        metadata={'Software': None},
+        pil_kwargs={'optimize': True, 'compress_level': 6}
+    )
+    return buffer.getvalue()
@@ -4,31 +4,86 @@ Provides intelligent document retrieval for mental wellness conversations
 """
 
 import os
+import re
 import json
-import pickle
+import hashlib
+import threading
 import numpy as np
 from typing import List, Dict, Any, Optional, Tuple
 import faiss
+import torch
 from sentence_transformers import SentenceTransformer
 import PyPDF2
 import docx
-import markdown
 from pathlib import Path
 import logging
+import multiprocessing
 from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Vector index type: hnsw (default), flat (exact search) or sq8 (8-bit scalar quantized)
+# plus the HNSW graph parameters
+RAG_INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "hnsw").lower()
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 40
+HNSW_EF_SEARCH = 16
+
+# Memory-map flat index codes on load where this faiss build supports it (read-only
+# pages shared between API worker processes); older builds fall back to a plain read
+INDEX_READ_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+# Sentence terminator followed by whitespace or end of text, used by the chunker
+SENTENCE_END_PATTERN = re.compile(r'[.!?](?:\s+|$)')
+
+# Markdown syntax removed for plain-text extraction: links/images (text kept in group 1),
+# line-leading heading/quote/list markers, code ticks, and emphasis/strikethrough runs
+# at a word edge (so snake_case_name and 2*3*4 keep their inner characters)
+MARKDOWN_SYNTAX_PATTERN = re.compile(
+    r'!?\[([^\]]*)\]\([^)]*\)'
+    r'|^[ \t]{0,3}(?:#{1,6}[ \t]+|>[ \t]?|[-*+][ \t]+|\d+\.[ \t]+)'
+    r'|`+|(?<!\w)(?:[*_]{1,3}|~~)|(?:[*_]{1,3}|~~)(?!\w)',
+    re.MULTILINE
+)
+
+# Formatted RAG contexts kept per enhanced query; the corpus is fixed once
+# initialized, so entries never go stale
+RAG_CONTEXT_CACHE_SIZE = 1024
+
+# Cosine similarity at which a new query reuses a cached query's context
+# (semantic cache for rephrasings); set above 1 to disable
+RAG_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("RAG_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+# SentenceTransformer inference backend: torch, or onnx / openvino for fused
+# graph runtimes (needs sentence-transformers[onnx-gpu|onnx|openvino])
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+
+# EMBEDDING_QUANTIZATION=int8 encodes with INT8 weights: dynamic Linear quantization
+# for torch on CPU (GPU keeps FP16), or the quantized ONNX export shipped in the
+# model repo for the onnx backend (pick the file matching the CPU's instruction set)
+EMBEDDING_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION", "none").lower()
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
+# Chunks per SentenceTransformer forward pass when indexing
+EMBEDDING_BATCH_SIZE = 64
+
+# Document parsing workers start from a clean forkserver (spawn where unavailable):
+# indexing can run inside the API after CUDA and its threads are up, where fork is unsafe
+EXTRACT_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+@dataclass(slots=True)
 class DocumentChunk:
     """Represents a chunk of document content with metadata"""
     content: str
     source: str
     chunk_id: int
     metadata: Dict[str, Any]
-    embedding: Optional[np.ndarray] = None
 
 class DocumentProcessor:
     """Processes different document types and extracts text content"""
@@ -41,10 +96,7 @@ class DocumentProcessor:
         try:
             with open(file_path, 'rb') as file:
                 reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+                return "\n".join(page.extract_text() for page in reader.pages)
         except Exception as e:
             logger.error(f"Error reading PDF {file_path}: {e}")
             return ""
@@ -53,10 +105,7 @@ class DocumentProcessor:
         """Extract text from DOCX files"""
         try:
             doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            return "\n".join(paragraph.text for paragraph in doc.paragraphs)
         except Exception as e:
             logger.error(f"Error reading DOCX {file_path}: {e}")
             return ""
@@ -75,12 +124,8 @@ class DocumentProcessor:
         try:
             with open(file_path, 'r', encoding='utf-8') as file:
                 md_content = file.read()
-                # Convert markdown to plain text (removing formatting)
-                html = markdown.markdown(md_content)
-                # Simple HTML tag removal (for basic extraction)
-                import re
-                text = re.sub('<[^<]+?>', '', html)
-                return text
+                # Strip markdown syntax in one pass, keeping link/image text
+                return MARKDOWN_SYNTAX_PATTERN.sub(lambda match: match.group(1) or "", md_content)
         except Exception as e:
             logger.error(f"Error reading MD {file_path}: {e}")
             return ""
@@ -113,68 +158,109 @@ class TextChunker:
         self.overlap = overlap
     
     def chunk_text(self, text: str, source: str) -> List[DocumentChunk]:
-        """Split text into overlapping chunks"""
+        """Split text into overlapping chunks on sentence boundaries"""
         chunks = []
-        sentences = text.split('.')
         
-        current_chunk = ""
-        chunk_id = 0
+        # Sentence end offsets; the tail after the last terminator is a sentence too
+        sentence_ends = [match.end() for match in SENTENCE_END_PATTERN.finditer(text)]
+        if not sentence_ends or sentence_ends[-1] < len(text):
+            sentence_ends.append(len(text))
         
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-            
+        chunk_start = 0
+        chunk_end = 0
+        
+        for sentence_end in sentence_ends:
             # Check if adding this sentence would exceed chunk size
-            if len(current_chunk) + len(sentence) > self.chunk_size and current_chunk:
-                # Create chunk
-                chunks.append(DocumentChunk(
-                    content=current_chunk.strip(),
-                    source=source,
-                    chunk_id=chunk_id,
-                    metadata={
-                        'length': len(current_chunk),
-                        'type': 'content_chunk'
-                    }
-                ))
+            if sentence_end - chunk_start > self.chunk_size and chunk_end > chunk_start:
+                self._append_chunk(chunks, text, chunk_start, chunk_end, source)
                 
                 # Start new chunk with overlap
-                overlap_text = current_chunk[-self.overlap:] if len(current_chunk) > self.overlap else current_chunk
-                current_chunk = overlap_text + " " + sentence + "."
-                chunk_id += 1
-            else:
-                current_chunk += " " + sentence + "."
+                chunk_start = max(chunk_end - self.overlap, chunk_start)
+            chunk_end = sentence_end
         
         # Add final chunk
-        if current_chunk.strip():
-            chunks.append(DocumentChunk(
-                content=current_chunk.strip(),
-                source=source,
-                chunk_id=chunk_id,
-                metadata={
-                    'length': len(current_chunk),
-                    'type': 'content_chunk'
-                }
-            ))
+        self._append_chunk(chunks, text, chunk_start, chunk_end, source)
         
         return chunks
+    
+    def _append_chunk(self, chunks: List[DocumentChunk], text: str, start: int, end: int, source: str):
+        """Slice text[start:end] into a chunk if it has any content"""
+        content = text[start:end].strip()
+        if not content:
+            return
+        chunks.append(DocumentChunk(
+            content=content,
+            source=source,
+            chunk_id=len(chunks),
+            metadata={
+                'length': len(content),
+                'start': start,
+                'end': end,
+                'type': 'content_chunk'
+            }
+        ))
 
 class RAGVectorStore:
     """FAISS-based vector store for document retrieval"""
     
-    def __init__(self, embedding_model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self, embedding_model_name: str = "all-MiniLM-L6-v2", cache_dir: Optional[str] = None):
         """Initialize the vector store with embedding model"""
-        self.embedding_model = SentenceTransformer(embedding_model_name)
+        self.embedding_model_name = embedding_model_name
+        # Embeddings keyed by model + chunk content hash, reused across re-indexing
+        self.cache_path = Path(cache_dir) / "embeddings.npz" if cache_dir else None
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        quantize_int8 = EMBEDDING_QUANTIZATION == "int8"
+        model_kwargs = {"file_name": EMBEDDING_ONNX_INT8_FILE} if quantize_int8 and EMBEDDING_BACKEND == "onnx" else None
+        self.embedding_model = SentenceTransformer(
+            embedding_model_name, device=self.device, backend=EMBEDDING_BACKEND, model_kwargs=model_kwargs
+        )
+        if self.device == "cuda" and EMBEDDING_BACKEND == "torch":
+            # FP16 weights halve encoder bandwidth; cosine ranking is unaffected
+            self.embedding_model.half()
+        elif quantize_int8 and EMBEDDING_BACKEND == "torch":
+            torch.quantization.quantize_dynamic(self.embedding_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
         self.embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
         
+        # HNSW has no GPU implementation, so only the flat index is moved to a GPU (faiss-gpu builds)
+        self.gpu_resources = None
+        if RAG_INDEX_TYPE == "flat" and hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0:
+            self.gpu_resources = faiss.StandardGpuResources()
+        
         # Initialize FAISS index
-        self.index = faiss.IndexFlatIP(self.embedding_dim)  # Inner product for cosine similarity
-        self.document_chunks: List[DocumentChunk] = []
+        self.index = self._create_index()
+        # Chunk columns, row i matches FAISS id i (embeddings live only in the index)
+        self.contents: List[str] = []
+        self.source_names: List[str] = []
+        self.source_ids = np.empty(0, dtype=np.int32)
+        self.chunk_ids = np.empty(0, dtype=np.int32)
+        self.chunk_offsets = np.empty((0, 2), dtype=np.int64)
         self.document_processor = DocumentProcessor()
         self.text_chunker = TextChunker()
         
         logger.info(f"Initialized RAG Vector Store with {embedding_model_name}")
         logger.info(f"Embedding dimension: {self.embedding_dim}")
+        logger.info(f"Embedding device: {self.device} ({EMBEDDING_BACKEND}, quantization: {EMBEDDING_QUANTIZATION}), FAISS on GPU: {self.gpu_resources is not None}")
+    
+    def _to_device(self, index: faiss.Index) -> faiss.Index:
+        """Move a CPU index to GPU 0 when GPU resources are available"""
+        if self.gpu_resources is None:
+            return index
+        return faiss.index_cpu_to_gpu(self.gpu_resources, 0, index)
+    
+    def _create_index(self) -> faiss.Index:
+        """Create an empty inner-product index (cosine similarity on normalized embeddings)"""
+        if RAG_INDEX_TYPE == "flat":
+            return self._to_device(faiss.IndexFlatIP(self.embedding_dim))
+        if RAG_INDEX_TYPE == "sq8":
+            # 1 byte per dimension instead of 4; trained on the first batch in add_documents
+            return faiss.IndexScalarQuantizer(
+                self.embedding_dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+        
+        index = faiss.IndexHNSWFlat(self.embedding_dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
     
     def add_documents(self, documents_dir: str) -> int:
         """Add all documents from a directory to the vector store"""
@@ -183,142 +269,251 @@ class RAGVectorStore:
             logger.error(f"Documents directory not found: {documents_dir}")
             return 0
         
-        added_count = 0
+        all_chunks: List[DocumentChunk] = []
+        file_paths = [file_path for file_path in documents_path.iterdir() if file_path.is_file()]
         
-        for file_path in documents_path.iterdir():
-            if file_path.is_file():
-                logger.info(f"Processing document: {file_path.name}")
-                
-                # Extract text from document
-                text_content = self.document_processor.process_document(str(file_path))
-                
-                if not text_content or len(text_content.strip()) < 50:
-                    logger.warning(f"Insufficient content in {file_path.name}, skipping")
-                    continue
-                
-                # Split into chunks
-                chunks = self.text_chunker.chunk_text(text_content, file_path.name)
-                
-                if not chunks:
-                    logger.warning(f"No chunks created for {file_path.name}")
-                    continue
-                
-                # Generate embeddings for chunks
-                embeddings = self._generate_embeddings([chunk.content for chunk in chunks])
-                
-                # Add embeddings to chunks and store
-                for chunk, embedding in zip(chunks, embeddings):
-                    chunk.embedding = embedding
-                    self.document_chunks.append(chunk)
-                
-                # Add to FAISS index
-                self.index.add(np.array(embeddings).astype('float32'))
-                
-                added_count += len(chunks)
-                logger.info(f"Added {len(chunks)} chunks from {file_path.name}")
+        # Extract text from all documents
+        text_contents = self._extract_texts(file_paths)
+        
+        for file_path, text_content in zip(file_paths, text_contents):
+            logger.info(f"Processing document: {file_path.name}")
+            
+            if not text_content or len(text_content.strip()) < 50:
+                logger.warning(f"Insufficient content in {file_path.name}, skipping")
+                continue
+            
+            # Split into chunks
+            chunks = self.text_chunker.chunk_text(text_content, file_path.name)
+            
+            if not chunks:
+                logger.warning(f"No chunks created for {file_path.name}")
+                continue
+            
+            all_chunks.extend(chunks)
+            logger.info(f"Chunked {file_path.name} into {len(chunks)} chunks")
         
+        if not all_chunks:
+            return 0
+        
+        # Generate embeddings for all chunks, encoding only cache misses in one batch
+        embeddings = self._generate_cached_embeddings([chunk.content for chunk in all_chunks])
+        if len(embeddings) != len(all_chunks):
+            logger.error("Embedding generation failed, no chunks added")
+            return 0
+        
+        # Store chunk columns and add to FAISS index
+        self._append_chunks(all_chunks)
+        if not self.index.is_trained:
+            self.index.train(embeddings)
+        self.index.add(embeddings)
+        
+        added_count = len(all_chunks)
         logger.info(f"Total documents processed: {added_count} chunks from {len(list(documents_path.iterdir()))} files")
         return added_count
     
-    def _generate_embeddings(self, texts: List[str]) -> List[np.ndarray]:
-        """Generate embeddings for a list of texts"""
+    def _extract_texts(self, file_paths: List[Path]) -> List[str]:
+        """Extract document texts in file order, parsing in worker processes when there are several"""
+        paths = [str(file_path) for file_path in file_paths]
+        if len(paths) < 2:
+            return [self.document_processor.process_document(path) for path in paths]
+        
+        with ProcessPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1), mp_context=EXTRACT_POOL_CONTEXT) as pool:
+            return list(pool.map(self.document_processor.process_document, paths))
+    
+    def _append_chunks(self, chunks: List[DocumentChunk]):
+        """Append chunks to the column store"""
+        source_index = {name: i for i, name in enumerate(self.source_names)}
+        source_ids = []
+        for chunk in chunks:
+            if chunk.source not in source_index:
+                source_index[chunk.source] = len(self.source_names)
+                self.source_names.append(chunk.source)
+            source_ids.append(source_index[chunk.source])
+        
+        self.contents.extend(chunk.content for chunk in chunks)
+        self.source_ids = np.concatenate([self.source_ids, np.array(source_ids, dtype=np.int32)])
+        self.chunk_ids = np.concatenate([self.chunk_ids, np.array([chunk.chunk_id for chunk in chunks], dtype=np.int32)])
+        offsets = np.array([(chunk.metadata['start'], chunk.metadata['end']) for chunk in chunks], dtype=np.int64)
+        self.chunk_offsets = np.concatenate([self.chunk_offsets, offsets.reshape(-1, 2)])
+    
+    def _chunk_view(self, idx: int) -> DocumentChunk:
+        """Build a DocumentChunk for row idx of the column store"""
+        content = self.contents[idx]
+        start, end = self.chunk_offsets[idx].tolist()
+        return DocumentChunk(
+            content=content,
+            source=self.source_names[self.source_ids[idx]],
+            chunk_id=int(self.chunk_ids[idx]),
+            metadata={
+                'length': len(content),
+                'start': start,
+                'end': end,
+                'type': 'content_chunk'
+            }
+        )
+    
+    def _content_key(self, text: str) -> str:
+        """Cache key for an embedding: hash of model name and text"""
+        return hashlib.blake2b(f"{self.embedding_model_name}\0{text}".encode(), digest_size=16).hexdigest()
+    
+    def _load_embedding_cache(self) -> Dict[str, np.ndarray]:
+        """Load cached embeddings as a key -> row mapping"""
+        if self.cache_path is None or not self.cache_path.exists():
+            return {}
         try:
-            embeddings = self.embedding_model.encode(texts, convert_to_numpy=True)
-            # Normalize embeddings for cosine similarity
-            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-            # Convert to list of arrays if it's a single array
-            if len(texts) == 1:
-                return [embeddings[0]]
-            else:
-                return list(embeddings)
+            with np.load(self.cache_path) as cached:
+                return dict(zip(cached['keys'].tolist(), cached['embeddings']))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable embedding cache {self.cache_path}: {e}")
+            return {}
+    
+    def _save_embedding_cache(self, cache: Dict[str, np.ndarray]):
+        """Write the embedding cache as a single file"""
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(
+                self.cache_path,
+                keys=np.array(list(cache.keys())),
+                embeddings=np.stack(list(cache.values())).astype(np.float32)
+            )
+        except Exception as e:
+            logger.warning(f"Could not write embedding cache {self.cache_path}: {e}")
+    
+    def _generate_cached_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings, reusing cached rows for unchanged texts"""
+        if self.cache_path is None:
+            return self._generate_embeddings(texts)
+        
+        cache = self._load_embedding_cache()
+        keys = [self._content_key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cache:
+                missing[key] = text
+        logger.info(f"Embedding cache: {len(missing)} of {len(texts)} chunks need encoding")
+        
+        if missing:
+            new_embeddings = self._generate_embeddings(list(missing.values()))
+            if len(new_embeddings) != len(missing):
+                return new_embeddings
+            cache.update(zip(missing.keys(), new_embeddings))
+        
+        embeddings = np.stack([cache[key] for key in keys]).astype(np.float32, copy=False)
+        
+        # Keep only the current corpus so removed chunks don't accumulate
+        if missing or len(cache) != len(set(keys)):
+            self._save_embedding_cache(dict(zip(keys, embeddings)))
+        
+        return embeddings
+    
+    def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate L2-normalized embeddings for a list of texts as a (n, dim) float32 array"""
+        try:
+            embeddings = self.embedding_model.encode(
+                texts,
+                batch_size=EMBEDDING_BATCH_SIZE,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            # Normalize in place for cosine similarity
+            faiss.normalize_L2(embeddings)
+            return embeddings
         except Exception as e:
             logger.error(f"Error generating embeddings: {e}")
-            return []
+            return np.empty((0, self.embedding_dim), dtype=np.float32)
     
     def search(self, query: str, k: int = 5, score_threshold: float = 0.1) -> List[Tuple[DocumentChunk, float]]:
         """Search for relevant document chunks"""
+        return self.search_batch([query], k, score_threshold)[0]
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Normalized float32 embeddings for queries, one row each"""
+        return self._generate_embeddings(queries)
+    
+    def search_batch(self, queries: List[str], k: int = 5, score_threshold: float = 0.1,
+                     query_embeddings: Optional[np.ndarray] = None) -> List[List[Tuple[DocumentChunk, float]]]:
+        """Search for several queries with one batched encode (unless given) and one index search"""
         if self.index.ntotal == 0:
             logger.warning("No documents in vector store")
-            return []
+            return [[] for _ in queries]
         
         try:
-            logger.debug(f"Starting search for query: '{query[:50]}...'")
+            logger.debug(f"Starting search for {len(queries)} queries")
             
-            # Generate query embedding
-            query_embeddings = self._generate_embeddings([query])
-            if not query_embeddings or len(query_embeddings) == 0:
+            # Generate query embeddings
+            if query_embeddings is None:
+                query_embeddings = self._generate_embeddings(queries)
+            if len(query_embeddings) != len(queries):
                 logger.error("Failed to generate query embedding")
-                return []
+                return [[] for _ in queries]
             
-            logger.debug("Generated query embedding successfully")
-            query_embedding = query_embeddings[0]
-            query_embedding = query_embedding.reshape(1, -1).astype('float32')
+            logger.debug("Generated query embeddings successfully")
             
             # Search FAISS index
             logger.debug("Searching FAISS index...")
-            scores, indices = self.index.search(query_embedding, min(k, self.index.ntotal))
-            logger.debug(f"FAISS search completed. Got {len(scores[0])} results")
-            
-            # Debug: Log all scores (safely convert numpy types)
-            try:
-                all_scores = [(float(score), int(idx)) for score, idx in zip(scores[0], indices[0])]
-                logger.info(f"Query: '{query[:50]}...' | Top scores: {all_scores[:3]}")
-            except Exception as e:
-                logger.warning(f"Error logging scores: {e}")
-            
-            # Filter results by score threshold
-            results = []
-            try:
-                for i in range(len(scores[0])):
-                    score_float = float(scores[0][i])  # Explicit index access
-                    idx_int = int(indices[0][i])       # Explicit index access
-                    
-                    if score_float >= score_threshold and idx_int < len(self.document_chunks):
-                        chunk = self.document_chunks[idx_int]
-                        results.append((chunk, score_float))
-            except Exception as e:
-                logger.error(f"Error filtering results: {e}")
-                return []
+            scores, indices = self.index.search(query_embeddings, min(k, self.index.ntotal))
+            logger.debug(f"FAISS search completed. Got {scores.shape[1]} results per query")
             
-            # If no results with threshold, return top result anyway (with very low threshold)
-            if not results and len(scores[0]) > 0:
-                try:
-                    logger.info(f"No results above threshold {score_threshold}, returning top result")
-                    top_idx = int(indices[0][0])
-                    top_score = float(scores[0][0])
-                    if top_idx < len(self.document_chunks):
-                        chunk = self.document_chunks[top_idx]
-                        results.append((chunk, top_score))
-                except Exception as e:
-                    logger.error(f"Error getting top result: {e}")
-                    return []
-            
-            logger.info(f"Found {len(results)} relevant chunks for query")
-            return results
+            return [
+                self._filter_results(query, query_scores, query_indices, score_threshold)
+                for query, query_scores, query_indices in zip(queries, scores.tolist(), indices.tolist())
+            ]
             
         except Exception as e:
             logger.error(f"Error during search: {e}")
-            return []
+            return [[] for _ in queries]
+    
+    def _filter_results(self, query: str, scores: List[float], indices: List[int], score_threshold: float) -> List[Tuple[DocumentChunk, float]]:
+        """Turn one query's index hits into (chunk, score) pairs above the threshold"""
+        logger.info(f"Query: '{query[:50]}...' | Top scores: {list(zip(scores, indices))[:3]}")
+        
+        # Filter results by score threshold
+        results = [
+            (self._chunk_view(idx), score)
+            for score, idx in zip(scores, indices)
+            if score >= score_threshold and 0 <= idx < len(self.contents)
+        ]
+        
+        # If no results with threshold, return top result anyway (with very low threshold)
+        if not results and scores:
+            logger.info(f"No results above threshold {score_threshold}, returning top result")
+            if 0 <= indices[0] < len(self.contents):
+                results.append((self._chunk_view(indices[0]), scores[0]))
+        
+        logger.info(f"Found {len(results)} relevant chunks for query")
+        return results
     
     def save_index(self, save_path: str):
         """Save the FAISS index and document chunks"""
         try:
             # Save FAISS index
-            faiss.write_index(self.index, f"{save_path}/faiss_index.bin")
+            index = faiss.index_gpu_to_cpu(self.index) if self.gpu_resources else self.index
+            faiss.write_index(index, f"{save_path}/faiss_index.bin")
             
-            # Save document chunks
-            with open(f"{save_path}/document_chunks.pkl", 'wb') as f:
-                pickle.dump(self.document_chunks, f)
+            # Save chunk columns; contents as one UTF-8 buffer plus byte bounds
+            encoded = [content.encode('utf-8') for content in self.contents]
+            text_bounds = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(b) for b in encoded], out=text_bounds[1:])
+            np.savez(
+                f"{save_path}/document_chunks.npz",
+                text=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                text_bounds=text_bounds,
+                source_names=np.array(self.source_names, dtype=str),
+                source_ids=self.source_ids,
+                chunk_ids=self.chunk_ids,
+                chunk_offsets=self.chunk_offsets
+            )
             
             # Save metadata
             metadata = {
-                'embedding_model': self.embedding_model,
+                'embedding_model': self.embedding_model_name,
                 'embedding_dim': self.embedding_dim,
-                'total_chunks': len(self.document_chunks)
+                'total_chunks': len(self.contents)
             }
             
             with open(f"{save_path}/metadata.json", 'w') as f:
-                json.dump({k: v for k, v in metadata.items() if k != 'embedding_model'}, f, indent=2)
+                json.dump(metadata, f, indent=2)
             
             logger.info(f"Saved vector store to {save_path}")
             
@@ -326,17 +521,46 @@ class RAGVectorStore:
             logger.error(f"Error saving index: {e}")
     
     def load_index(self, load_path: str) -> bool:
-        """Load a saved FAISS index and document chunks"""
+        """Load a saved FAISS index (memory-mapped, read-only) and document chunks"""
         try:
-            # Load FAISS index
-            self.index = faiss.read_index(f"{load_path}/faiss_index.bin")
+            # Vectors from a different embedding model can't be searched with this one
+            with open(f"{load_path}/metadata.json") as f:
+                saved_model = json.load(f).get('embedding_model')
+            if saved_model != self.embedding_model_name:
+                logger.warning(f"Saved index was built with {saved_model}, not {self.embedding_model_name}; rebuilding")
+                return False
+            
+            # Read every part into locals first; a failure below leaves this store untouched
+            index = faiss.read_index(f"{load_path}/faiss_index.bin", INDEX_READ_FLAGS)
+            
+            # Load chunk columns
+            with np.load(f"{load_path}/document_chunks.npz") as data:
+                text = data['text'].tobytes()
+                text_bounds = data['text_bounds'].tolist()
+                contents = [text[start:end].decode('utf-8') for start, end in zip(text_bounds, text_bounds[1:])]
+                source_names = data['source_names'].tolist()
+                source_ids = data['source_ids']
+                chunk_ids = data['chunk_ids']
+                chunk_offsets = data['chunk_offsets']
+            
+            if index.ntotal != len(contents):
+                logger.warning(f"Saved index has {index.ntotal} vectors but {len(contents)} chunks; rebuilding")
+                return False
             
-            # Load document chunks
-            with open(f"{load_path}/document_chunks.pkl", 'rb') as f:
-                self.document_chunks = pickle.load(f)
+            if hasattr(index, "hnsw"):
+                index.hnsw.efSearch = HNSW_EF_SEARCH
+            else:
+                index = self._to_device(index)
+            
+            self.index = index
+            self.contents = contents
+            self.source_names = source_names
+            self.source_ids = source_ids
+            self.chunk_ids = chunk_ids
+            self.chunk_offsets = chunk_offsets
             
             logger.info(f"Loaded vector store from {load_path}")
-            logger.info(f"Loaded {len(self.document_chunks)} document chunks")
+            logger.info(f"Loaded {len(self.contents)} document chunks")
             return True
             
         except Exception as e:
@@ -345,13 +569,11 @@ class RAGVectorStore:
     
     def get_stats(self) -> Dict[str, Any]:
         """Get statistics about the vector store"""
-        source_counts = {}
-        for chunk in self.document_chunks:
-            source = chunk.source
-            source_counts[source] = source_counts.get(source, 0) + 1
+        counts = np.bincount(self.source_ids, minlength=len(self.source_names))
+        source_counts = {name: int(count) for name, count in zip(self.source_names, counts) if count}
         
         return {
-            'total_chunks': len(self.document_chunks),
+            'total_chunks': len(self.contents),
             'embedding_dimension': self.embedding_dim,
             'index_size': self.index.ntotal,
             'documents_by_source': source_counts
@@ -361,9 +583,9 @@ class MentalWellnessRAG:
     """Mental Wellness specific RAG system"""
     
     def __init__(self, documents_dir: str, vector_store_path: str = None):
-        self.vector_store = RAGVectorStore()
         self.documents_dir = documents_dir
         self.vector_store_path = vector_store_path or os.path.join(documents_dir, "../data/vector_store")
+        self.vector_store = RAGVectorStore(cache_dir=os.path.join(self.vector_store_path, "emb_cache"))
         
         # Mental wellness specific keywords for context enhancement
         self.wellness_keywords = {
@@ -374,6 +596,16 @@ class MentalWellnessRAG:
             'therapy': ['cbt', 'counseling', 'treatment', 'therapeutic', 'mindfulness'],
             'crisis': ['suicide', 'self-harm', 'crisis', 'emergency', 'help']
         }
+        
+        # LRU of enhanced query -> formatted context, shared by inference threads
+        self.context_cache: OrderedDict = OrderedDict()
+        self.context_cache_lock = threading.Lock()
+        
+        # Semantic cache: ring buffer of recent query embeddings and their contexts,
+        # probed with one matrix product so rephrased queries skip the index search
+        self.semantic_embeddings = np.zeros((RAG_CONTEXT_CACHE_SIZE, self.vector_store.embedding_dim), dtype=np.float32)
+        self.semantic_contexts: List[Optional[str]] = [None] * RAG_CONTEXT_CACHE_SIZE
+        self.semantic_next = 0
     
     def initialize(self) -> bool:
         """Initialize the RAG system"""
@@ -418,32 +650,92 @@ class MentalWellnessRAG:
     
     def retrieve_context(self, query: str, context_type: str = None, k: int = 3) -> List[Dict[str, Any]]:
         """Retrieve relevant context for a query"""
-        # Enhance query with wellness context
-        enhanced_query = self.enhance_query(query, context_type)
+        return self.retrieve_context_batch([(query, context_type)], k)[0]
+    
+    def retrieve_context_batch(self, queries: List[Tuple[str, Optional[str]]], k: int = 3,
+                               query_embeddings: Optional[np.ndarray] = None) -> List[List[Dict[str, Any]]]:
+        """Retrieve relevant context for several (query, context_type) pairs in one vector search"""
+        # Enhance queries with wellness context
+        enhanced_queries = [self.enhance_query(query, context_type) for query, context_type in queries]
         
         # Search vector store
-        results = self.vector_store.search(enhanced_query, k=k, score_threshold=0.05)
+        batch_results = self.vector_store.search_batch(
+            enhanced_queries, k=k, score_threshold=0.05, query_embeddings=query_embeddings
+        )
         
         # Format results
-        context_chunks = []
-        for chunk, score in results:
-            context_chunks.append({
-                'content': chunk.content,
-                'source': chunk.source,
-                'relevance_score': score,
-                'metadata': chunk.metadata
-            })
-        
-        return context_chunks
+        return [
+            [
+                {
+                    'content': chunk.content,
+                    'source': chunk.source,
+                    'relevance_score': score,
+                    'metadata': chunk.metadata
+                }
+                for chunk, score in results
+            ]
+            for results in batch_results
+        ]
     
     def get_rag_response_context(self, query: str, context_type: str = None) -> str:
         """Get formatted context for RAG-enhanced responses"""
-        context_chunks = self.retrieve_context(query, context_type, k=3)
+        return self.get_rag_response_context_batch([(query, context_type)])[0]
+    
+    def get_rag_response_context_batch(self, queries: List[Tuple[str, Optional[str]]]) -> List[str]:
+        """Get formatted context for several (query, context_type) pairs, searching only uncached queries"""
+        enhanced_queries = [self.enhance_query(query, context_type) for query, context_type in queries]
         
+        with self.context_cache_lock:
+            contexts = {}
+            for enhanced_query in enhanced_queries:
+                if enhanced_query in self.context_cache:
+                    self.context_cache.move_to_end(enhanced_query)
+                    contexts[enhanced_query] = self.context_cache[enhanced_query]
+        
+        missing = [enhanced_query for enhanced_query in dict.fromkeys(enhanced_queries) if enhanced_query not in contexts]
+        if missing:
+            contexts.update(self._get_uncached_contexts(missing))
+        
+        return [contexts[enhanced_query] for enhanced_query in enhanced_queries]
+    
+    def _get_uncached_contexts(self, enhanced_queries: List[str]) -> Dict[str, str]:
+        """Contexts for exact-cache misses: semantic cache hits first, one index search for the rest"""
+        embeddings = self.vector_store.encode_queries(enhanced_queries)
+        if len(embeddings) != len(enhanced_queries):
+            return {enhanced_query: "" for enhanced_query in enhanced_queries}
+        
+        contexts = {}
+        with self.context_cache_lock:
+            similarities = embeddings @ self.semantic_embeddings.T
+            best = similarities.argmax(axis=1)
+            for row, enhanced_query in enumerate(enhanced_queries):
+                if similarities[row, best[row]] >= RAG_SEMANTIC_CACHE_THRESHOLD:
+                    contexts[enhanced_query] = self.semantic_contexts[best[row]]
+        
+        rows = [row for row, enhanced_query in enumerate(enhanced_queries) if enhanced_query not in contexts]
+        if rows:
+            batch_results = self.retrieve_context_batch(
+                [(enhanced_queries[row], None) for row in rows], k=3, query_embeddings=embeddings[rows]
+            )
+            with self.context_cache_lock:
+                for row, chunks in zip(rows, batch_results):
+                    contexts[enhanced_queries[row]] = self._format_context(chunks)
+                    self.semantic_embeddings[self.semantic_next] = embeddings[row]
+                    self.semantic_contexts[self.semantic_next] = contexts[enhanced_queries[row]]
+                    self.semantic_next = (self.semantic_next + 1) % RAG_CONTEXT_CACHE_SIZE
+        
+        with self.context_cache_lock:
+            self.context_cache.update(contexts)
+            while len(self.context_cache) > RAG_CONTEXT_CACHE_SIZE:
+                self.context_cache.popitem(last=False)
+        
+        return contexts
+    
+    def _format_context(self, context_chunks: List[Dict[str, Any]]) -> str:
+        """Format retrieved chunks for the AI model"""
         if not context_chunks:
             return ""
         
-        # Format context for the AI model
         context_text = "Relevant information from mental wellness resources:\n\n"
         
         for i, chunk in enumerate(context_chunks, 1):
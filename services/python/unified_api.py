@@ -3,34 +3,47 @@ Unified Mental Wellness API Gateway
 Combines LLM, Intent Classification, and Analytics into a single FastAPI service
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Mapping, Optional
+from types import MappingProxyType
 import os
+import asyncio
+import functools
+import importlib.util
+import hashlib
+import json
+import logging
+import multiprocessing
+import queue
+import secrets
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from datetime import datetime, timedelta
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from datetime import datetime
 import sqlite3
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import pandas as pd
-import io
-import base64
 import re
-import numpy as np
-from faster_whisper import WhisperModel
 import tempfile
 # librosa removed - not needed
 from dotenv import load_dotenv
 
-# RAG System imports
-from rag_system import MentalWellnessRAG
-
 # Load environment variables from root .env file
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
 
+# Per-request logging; messages are formatted only when their level is enabled.
+# Startup/shutdown banners stay on stdout
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
+
 # =============================================
 # REQUEST/RESPONSE MODELS
 # =============================================
@@ -64,6 +77,9 @@ class MoodEntry(BaseModel):
     session_type: str
     feedback_text: Optional[str] = None
 
+class MoodEntryBatch(BaseModel):
+    entries: List[MoodEntry]
+
 class AnalyticsResponse(BaseModel):
     user_id: int
     average_mood: float
@@ -92,32 +108,139 @@ tokenizer = None
 model = None
 device = None
 
+# Queried once; the GPU set can't change while the process runs
+CUDA_AVAILABLE = torch.cuda.is_available()
+
+# Optional quantized GGUF runtime (LLM_BACKEND=llama_cpp); when loaded it
+# serves chat generation instead of the transformers model
+llama_model = None
+
+# Optional vLLM engine (LLM_BACKEND=vllm); its AsyncLLMEngine does continuous
+# (in-flight) batching itself, so requests bypass the generation batcher.
+# Sampling mirrors GENERATION_CONFIG
+vllm_model = None
+vllm_sampling_params = None
+
 # Whisper Model variables
 whisper_model = None
+WHISPER_TRANSCRIBE_CONFIG = dict(
+    beam_size=1,
+    best_of=1,
+    vad_filter=True,
+    vad_parameters=dict(min_silence_duration_ms=500)
+)
+
+# Uploaded audio is copied to its temp file in chunks of this many bytes
+UPLOAD_CHUNK_SIZE = 1 << 20
+# Largest audio upload accepted for transcription
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_MB", "25")) * 1024 * 1024
 
 # RAG System variable
 rag_system = None
 
+# SQLite connection pool (connections are reused across requests)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+db_pool = None
+db_pool_lock = threading.Lock()
+
+# Process pool for chart rasterization (created at startup). Workers start from a
+# clean forkserver (spawn where unavailable), never by forking this process once
+# CUDA and the inference threads are running. Both methods re-run a script
+# __main__ in every worker, so serve via `python -m uvicorn unified_api:app`
+# (as start.ps1 does) rather than `python unified_api.py`
+chart_pool = None
+CHART_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+if CHART_POOL_CONTEXT.get_start_method() == "forkserver":
+    # Workers fork from a server that already imported the chart module
+    CHART_POOL_CONTEXT.set_forkserver_preload(["mood_charts"])
+
+# Thread pool for blocking model inference and retrieval, so generation
+# doesn't stall the event loop (created at startup)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+inference_pool = None
+
+# Serializes every Phi-3 call (batched, streamed, LangChain): the static KV cache,
+# compiled CUDA graphs and llama.cpp's Llama object are not safe to share across threads
+generation_lock = threading.Lock()
+
+# Chat micro-batching: concurrent prompts collected within the window are
+# generated together in one padded model.generate call
+GENERATION_BATCH_SIZE = int(os.getenv("GENERATION_BATCH_SIZE", "8"))
+GENERATION_BATCH_WINDOW_MS = int(os.getenv("GENERATION_BATCH_WINDOW_MS", "20"))
+generation_batcher = None
+
+# RAG retrieval micro-batching: concurrent queries share one embedding encode
+# and one FAISS search
+RAG_BATCH_SIZE = int(os.getenv("RAG_BATCH_SIZE", "16"))
+RAG_BATCH_WINDOW_MS = int(os.getenv("RAG_BATCH_WINDOW_MS", "5"))
+retrieval_batcher = None
+
+# Fixed chat system prompt; RAG context is spliced in per request
+CHAT_SYSTEM_PROMPT = "You are a friendly mental wellness companion. Respond naturally and helpfully."
+RAG_CONTEXT_INSTRUCTION = "Use this information to provide more helpful and accurate responses, but keep your response conversational and natural."
+
+# Reply length cap and decoding mode, shared by every generation backend.
+# CHAT_GREEDY=true decodes deterministically and skips the per-step
+# temperature/top-k/top-p filtering; generation also ends at the next turn marker
+CHAT_MAX_NEW_TOKENS = int(os.getenv("CHAT_MAX_NEW_TOKENS", "200"))
+CHAT_GREEDY = os.getenv("CHAT_GREEDY", "false").lower() == "true"
+CHAT_SAMPLING = {} if CHAT_GREEDY else dict(temperature=0.8, top_p=0.95, top_k=50)
+
+# Sampling settings shared by batched and streamed chat generation
+GENERATION_CONFIG = dict(
+    max_new_tokens=CHAT_MAX_NEW_TOKENS,
+    do_sample=not CHAT_GREEDY,
+    **CHAT_SAMPLING,
+    repetition_penalty=1.1,
+    stop_strings=["User:", "USER:"],  # End at the turn boundary (needs tokenizer=)
+    use_cache=True  # Reuse attention KV across decode steps
+)
+
+# Static KV cache (STATIC_KV_CACHE=true): fixed-shape decode steps that
+# transformers compiles and replays as CUDA graphs; prompts are padded to
+# length buckets so prefill shapes repeat too
+STATIC_KV_CACHE = os.getenv("STATIC_KV_CACHE", "false").lower() == "true"
+PROMPT_LENGTH_BUCKET = 256 if STATIC_KV_CACHE else None
+if STATIC_KV_CACHE:
+    GENERATION_CONFIG["cache_implementation"] = "static"
+
+# llama.cpp and vLLM treat temperature 0 as greedy decoding
+LLAMA_GENERATION_CONFIG = dict(
+    max_tokens=CHAT_MAX_NEW_TOKENS,
+    **(CHAT_SAMPLING or dict(temperature=0.0)),
+    repeat_penalty=1.1
+)
+VLLM_GENERATION_CONFIG = dict(
+    max_tokens=CHAT_MAX_NEW_TOKENS,
+    **(CHAT_SAMPLING or dict(temperature=0.0)),
+    repetition_penalty=1.1,
+    stop=["User:", "USER:"]
+)
+
+# Rendered chart PNGs served from disk; file names derive from
+# (user_id, days, last mood id, entry count), so a new mood entry yields a new
+# file and stale charts age out of the LRU-by-mtime eviction
+CHART_CACHE_SIZE = 256
+chart_url_key = os.getenv("CHART_URL_KEY", secrets.token_hex(16)).encode()
+
 # LangChain imports and setup
 from langchain.llms.base import LLM
 from langchain_core.callbacks.manager import CallbackManagerForLLMRun
 from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationChain
 from langchain_core.prompts import PromptTemplate
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from typing import Any, List, Optional
 
 # Import Model Context Protocol
 import sys
-import os
 # Add current directory to Python path for importing mcp_context
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-from mcp_context import mcp_manager, ConversationContext
+from mcp_context import mcp_manager
+from mood_charts import generate_mood_chart_bytes
 
 # LangChain custom LLM wrapper for Phi-3
 class Phi3LLM(LLM):
@@ -153,30 +276,23 @@ class Phi3LLM(LLM):
             formatted_prompt = f"<|system|>\n{system_prompt}<|end|>\n<|user|>\n{prompt}<|end|>\n<|assistant|>\n"
             
             # Tokenize and generate
-            inputs = tokenizer(formatted_prompt, return_tensors="pt", truncate=True, max_length=512)
-            inputs = {k: v.to(device) for k, v in inputs.items()}
+            inputs = tokenizer(formatted_prompt, return_tensors="pt", truncation=True, max_length=512).to(device)
             
-            with torch.no_grad():
-                outputs = model.generate(
-                    **inputs,
-                    max_new_tokens=256,
-                    temperature=0.7,
-                    do_sample=True,
-                    pad_token_id=tokenizer.eos_token_id,
-                    use_cache=False
-                )
-            
-            # Decode response
-            response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract assistant response
-            if "<|assistant|>" in response:
-                response = response.split("<|assistant|>")[-1].strip()
+            outputs = run_generation(
+                inputs,
+                max_new_tokens=256,
+                temperature=0.7,
+                do_sample=True,
+                pad_token_id=tokenizer.eos_token_id,
+                use_cache=True
+            )
             
-            return response
+            # Decode only the generated tokens, not the echoed prompt
+            prompt_length = inputs["input_ids"].shape[1]
+            return tokenizer.decode(outputs[0, prompt_length:], skip_special_tokens=True).strip()
             
         except Exception as e:
-            print(f"❌ Phi-3 LLM call error: {e}")
+            logger.error("❌ Phi-3 LLM call error: %s", e)
             return f"I'm experiencing technical difficulties. Please try again. ({str(e)})"
 
 # Global LangChain components
@@ -218,6 +334,118 @@ INTENT_PATTERNS = {
     }
 }
 
+INSERT_MOOD_SQL = """
+    INSERT INTO mood_history (user_id, mood_score, session_type, feedback_text, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+# All intent patterns fused into one alternation: a single scan tells whether a
+# message matches any pattern at all. finditer only yields non-overlapping
+# matches (a greedy ".*" can swallow another pattern's span), so hits are then
+# counted with the per-pattern matchers. Matchers are case-insensitive so
+# messages are scanned as-is, without a lowered copy.
+COMBINED_INTENT_PATTERN = re.compile("|".join(
+    f"(?:{pattern})"
+    for config in INTENT_PATTERNS.values()
+    for pattern in config["patterns"]
+), re.IGNORECASE)
+INTENT_PATTERN_MATCHERS = [
+    (intent_name, re.compile(pattern, re.IGNORECASE))
+    for intent_name, config in INTENT_PATTERNS.items()
+    for pattern in config["patterns"]
+]
+
+# Optional Hyperscan database over the same patterns: a DFA scan that reports
+# every pattern once (HS_FLAG_SINGLEMATCH), overlapping matches included
+INTENT_PATTERN_OWNERS = [
+    intent_name
+    for intent_name, config in INTENT_PATTERNS.items()
+    for _ in config["patterns"]
+]
+try:
+    import hyperscan
+    intent_pattern_db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+    intent_pattern_db.compile(
+        expressions=[
+            pattern.encode()
+            for config in INTENT_PATTERNS.values()
+            for pattern in config["patterns"]
+        ],
+        ids=list(range(len(INTENT_PATTERN_OWNERS))),
+        elements=len(INTENT_PATTERN_OWNERS),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(INTENT_PATTERN_OWNERS)
+    )
+except ImportError:
+    intent_pattern_db = None
+
+# Keyword -> owning intent, plus a lookahead alternation (longest keyword first)
+# that reports every keyword occurrence, overlaps included, in one pass
+INTENT_KEYWORDS = {
+    keyword: intent_name
+    for intent_name, config in INTENT_PATTERNS.items()
+    for keyword in config["keywords"]
+}
+COMBINED_KEYWORD_PATTERN = re.compile("(?=(" + "|".join(
+    re.escape(keyword) for keyword in sorted(INTENT_KEYWORDS, key=len, reverse=True)
+) + "))", re.IGNORECASE)
+
+# Fixed classification returned when no keyword or pattern matches; shared
+# read-only so the no-match path allocates nothing
+DEFAULT_INTENT_RESULT = MappingProxyType({
+    "intent": "navigation",
+    "confidence": 0.3,
+    "suggested_service": "navigation-assistance",
+    "reasoning": "Default classification"
+})
+
+# Unambiguous crisis phrases: any hit routes straight to crisis support
+# before keyword/pattern scoring runs
+CRISIS_PHRASES = ("suicide", "kill myself", "end it all", "hurt myself", "want to die")
+CRISIS_PATTERN = re.compile("|".join(map(re.escape, CRISIS_PHRASES)), re.IGNORECASE)
+CRISIS_INTENT_RESULT = MappingProxyType({
+    "intent": "crisis",
+    "confidence": INTENT_PATTERNS["crisis"]["confidence"],
+    "suggested_service": INTENT_PATTERNS["crisis"]["service"],
+    "reasoning": "Matched high-priority crisis phrase"
+})
+
+# RAG context routing keywords, in priority order, matched in one scan
+RAG_CONTEXT_KEYWORDS = {
+    "anxiety": ["anxious", "anxiety", "worry", "panic"],
+    "depression": ["sad", "depressed", "depression", "hopeless"],
+    "stress": ["stress", "overwhelmed", "pressure"],
+    "therapy": ["mindful", "meditation", "breathing"],
+}
+RAG_CONTEXT_PATTERN = re.compile("|".join(
+    f"(?P<{context_type}>{'|'.join(keywords)})"
+    for context_type, keywords in RAG_CONTEXT_KEYWORDS.items()
+), re.IGNORECASE)
+
+# Mood analytics queries (all filtered by user_id and ISO timestamp cutoff).
+# The cutoff is computed by SQLite from a bound '-N days' modifier, in local
+# time and ISO 'T' format to match the isoformat() strings stored on insert.
+MOOD_WINDOW_FILTER = "user_id = ? AND timestamp >= strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime', ?)"
+
+# One pass over the index range: overall average, count, newest id, and the
+# averages of the last 7 entries vs. everything before them (trend)
+MOOD_SUMMARY_SQL = f"""
+    SELECT AVG(mood_score), COUNT(*), MAX(id),
+           AVG(CASE WHEN rn <= 7 THEN mood_score END),
+           AVG(CASE WHEN rn > 7 THEN mood_score END)
+    FROM (
+        SELECT id, mood_score, ROW_NUMBER() OVER (ORDER BY timestamp DESC) AS rn
+        FROM mood_history
+        WHERE {MOOD_WINDOW_FILTER}
+    )
+"""
+
+MOOD_DATA_SQL = f"""
+    SELECT mood_score, session_type, timestamp, feedback_text
+    FROM mood_history
+    WHERE {MOOD_WINDOW_FILTER}
+    ORDER BY timestamp ASC
+"""
+
 # =============================================
 # UTILITY FUNCTIONS
 # =============================================
@@ -238,39 +466,147 @@ def get_db_path():
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
     return db_path
 
-def get_db_connection():
-    """Get SQLite database connection"""
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
+def _create_db_connection():
+    """Open a long-lived SQLite connection for the pool"""
+    conn = sqlite3.connect(get_db_path(), check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL makes NORMAL sync crash-safe; keep temp b-trees in RAM and read pages via mmap
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
+def _get_db_pool():
+    """Lazily build the SQLite connection pool"""
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                pool = queue.Queue()
+                for _ in range(DB_POOL_SIZE):
+                    pool.put(_create_db_connection())
+                db_pool = pool
+    return db_pool
+
+@contextmanager
+def get_db_connection():
+    """Borrow a pooled SQLite connection for the duration of a request"""
+    pool = _get_db_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
 def initialize_database():
     """Initialize database tables if they don't exist"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create mood_history table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS mood_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            mood_score INTEGER NOT NULL,
-            session_type TEXT,
-            feedback_text TEXT,
-            timestamp TEXT NOT NULL
-        )
-    """)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        # Create mood_history table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS mood_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                mood_score INTEGER NOT NULL,
+                session_type TEXT,
+                feedback_text TEXT,
+                timestamp TEXT NOT NULL
+            )
+        """)
+        
+        # Analytics filters by user and ISO timestamp range. Databases created by
+        # scripts/setup-database.py (sql/schema_sqlite.sql) name the column recorded_at
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(mood_history)")}
+        timestamp_column = "timestamp" if "timestamp" in columns else "recorded_at"
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_mood_user_ts
+            ON mood_history(user_id, {timestamp_column})
+        """)
+        
+        # Refresh planner statistics from a bounded sample so startup cost stays flat
+        cursor.execute("PRAGMA analysis_limit=400")
+        cursor.execute("ANALYZE")
+
+def load_llama_cpp_model():
+    """Load a quantized GGUF Phi-3 export with llama.cpp (CUDA offload)"""
+    global llama_model
+    
+    gguf_path = os.getenv("GGUF_MODEL_PATH", "models/phi-3-mini-4k-instruct-q4_k_m.gguf")
+    if not os.path.isabs(gguf_path):
+        gguf_path = os.path.join(os.path.dirname(__file__), '..', '..', gguf_path)
     
-    conn.commit()
-    conn.close()
+    if not os.path.exists(gguf_path):
+        print(f"⚠️ GGUF model not found at {gguf_path} - using transformers backend")
+        return False
+    
+    try:
+        from llama_cpp import Llama
+    except ImportError:
+        print("⚠️ llama-cpp-python not installed - using transformers backend")
+        return False
+    
+    print(f"📁 Loading GGUF Phi-3-mini from: {gguf_path}")
+    llama_model = Llama(model_path=gguf_path, n_gpu_layers=-1, n_ctx=2048, verbose=False)
+    print("✅ Phi-3-mini (llama.cpp) loaded successfully!")
+    return True
+
+def get_phi3_model_path() -> str:
+    """Local Phi-3 checkpoint directory (MODEL_PATH) if present, else the HuggingFace id (MODEL_NAME)"""
+    model_name = os.getenv("MODEL_NAME", "microsoft/Phi-3-mini-4k-instruct")
+    model_path = os.getenv("MODEL_PATH", "models/phi-3-mini-4k-instruct")
+    
+    # If relative path, make it relative to project root
+    if not os.path.isabs(model_path):
+        project_root = os.path.join(os.path.dirname(__file__), '..', '..')
+        model_path = os.path.join(project_root, model_path)
+    
+    return model_path if os.path.exists(model_path) else model_name
+
+def load_vllm_model():
+    """Load Phi-3-mini into a vLLM async engine (set VLLM_QUANTIZATION=fp8/awq/gptq)"""
+    global vllm_model, vllm_sampling_params
+    
+    try:
+        from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
+    except ImportError:
+        print("⚠️ vLLM not installed - using transformers backend")
+        return False
+    
+    model_path = get_phi3_model_path()
+    print(f"🔄 Loading Phi-3-mini with vLLM from: {model_path}")
+    vllm_model = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(
+        model=model_path,
+        quantization=os.getenv("VLLM_QUANTIZATION") or None,
+        dtype="float16",
+        max_model_len=4096,
+        max_num_seqs=int(os.getenv("VLLM_MAX_NUM_SEQS", "32")),
+        # Every chat prompt opens with CHAT_SYSTEM_PROMPT; reuse its KV blocks across requests
+        enable_prefix_caching=True,
+        gpu_memory_utilization=float(os.getenv("VLLM_GPU_MEMORY_UTILIZATION", "0.8"))
+    ))
+    vllm_sampling_params = SamplingParams(**VLLM_GENERATION_CONFIG)
+    print("✅ Phi-3-mini (vLLM) loaded successfully!")
+    return True
+
+def llm_loaded() -> bool:
+    """True when any chat generation backend is ready"""
+    return vllm_model is not None or llama_model is not None or (model is not None and tokenizer is not None)
 
 def load_phi3_model():
     """Load Phi-3-mini model with CUDA - NO FALLBACKS"""
     global tokenizer, model, device
     
+    # Prefer vLLM or the GGUF runtime when requested; transformers stays the fallback
+    llm_backend = os.getenv("LLM_BACKEND", "transformers").lower()
+    if llm_backend == "vllm" and load_vllm_model():
+        return True
+    if llm_backend == "llama_cpp" and load_llama_cpp_model():
+        return True
+    
     # Force CUDA usage - fail if not available
-    if not torch.cuda.is_available():
+    if not CUDA_AVAILABLE:
         raise RuntimeError("❌ CUDA is required but not available! Install CUDA-enabled PyTorch.")
     
     device = torch.device("cuda")
@@ -279,65 +615,101 @@ def load_phi3_model():
     print(f"💾 GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1024**3:.1f} GB")
     
     # Get model configuration from environment variables
-    model_name = os.getenv("MODEL_NAME", "microsoft/Phi-3-mini-4k-instruct")
-    model_path_env = os.getenv("MODEL_PATH", "models/phi-3-mini-4k-instruct")
-    
-    # If relative path, make it relative to project root
-    if not os.path.isabs(model_path_env):
-        project_root = os.path.join(os.path.dirname(__file__), '..', '..')
-        model_path = os.path.join(project_root, model_path_env)
-    else:
-        model_path = model_path_env
+    model_path = get_phi3_model_path()
     
     try:
         # Load model from local path if exists, otherwise from HuggingFace
         if os.path.exists(model_path):
             print(f"📁 Loading Phi-3-mini from: {model_path}")
-            tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
         else:
-            print(f"🌐 Loading Phi-3-mini from HuggingFace: {model_name}")
-            tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
-            model_path = model_name
-        
-        # Load with 4-bit quantization for GPU
-        from transformers import BitsAndBytesConfig
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.float16,
-            bnb_4bit_use_double_quant=True,
-        )
+            print(f"🌐 Loading Phi-3-mini from HuggingFace: {model_path}")
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+        
+        # Left padding so batched prompts all end where generation starts;
+        # over-long prompts lose their oldest tokens, never the user's turn
+        tokenizer.padding_side = "left"
+        tokenizer.truncation_side = "left"
+        
+        # Quantized weights for GPU: NF4 via bitsandbytes at load time (bnb4, default),
+        # LLM.int8() weights (bnb8), FP8 row-wise FBGEMM kernels on Hopper/Ada (fp8), or a pre-quantized
+        # checkpoint that carries its own config and fused kernels (awq, gptq,
+        # w8a8 compressed-tensors)
+        model_quantization = os.getenv("MODEL_QUANTIZATION", "bnb4").lower()
+        quantization_config = None
+        torch_dtype = torch.float16
+        if model_quantization == "fp8":
+            from transformers import FbgemmFp8Config
+            quantization_config = FbgemmFp8Config()
+            torch_dtype = torch.bfloat16
+        elif model_quantization == "bnb8":
+            from transformers import BitsAndBytesConfig
+            quantization_config = BitsAndBytesConfig(load_in_8bit=True, llm_int8_threshold=6.0)
+        elif model_quantization == "bnb4":
+            from transformers import BitsAndBytesConfig
+            quantization_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_use_double_quant=True,
+            )
         
-        print("🔄 Loading model with 4-bit quantization...")
+        # Fused attention kernels: FlashAttention-2 when installed, else PyTorch SDPA
+        attn_implementation = "flash_attention_2" if importlib.util.find_spec("flash_attn") else "sdpa"
+        
+        print(f"🔄 Loading model with {model_quantization} quantization ({attn_implementation} attention)...")
         model = AutoModelForCausalLM.from_pretrained(
             model_path,
-            quantization_config=bnb_config,
-            trust_remote_code=True,
-            torch_dtype=torch.float16,
-            device_map="auto"
+            quantization_config=quantization_config,
+            torch_dtype=torch_dtype,
+            device_map="auto",
+            attn_implementation=attn_implementation
         )
         
         print("✅ Phi-3-mini loaded successfully on GPU!")
+        
+        if os.getenv("TORCH_COMPILE", "false").lower() == "true":
+            compile_phi3_model()
+        else:
+            warm_up_phi3_model()
         return True
         
     except Exception as e:
         print(f"❌ CRITICAL ERROR loading Phi-3 model: {e}")
         raise RuntimeError(f"Failed to load Phi-3 model: {e}")  # No fallbacks!
 
+def warm_up_phi3_model():
+    """Run a tiny generate so CUDA allocator and kernel setup happen before the first request"""
+    inputs = tokenizer("Hello", return_tensors="pt").to(device)
+    run_generation(inputs, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+
+def compile_phi3_model():
+    """Compile the Phi-3 forward pass (Inductor + CUDA graphs) and warm it up"""
+    print("🔄 Compiling Phi-3 forward with torch.compile (reduce-overhead)...")
+    # dynamic=True keeps varying prompt lengths from triggering recompiles
+    model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False, dynamic=True)
+    
+    # First calls pay the compile cost; do it at startup rather than on a user request
+    started = time.perf_counter()
+    generate_batch([f"{CHAT_SYSTEM_PROMPT}\n\nUser: Hello\nAssistant:"])
+    print(f"✅ Phi-3 compiled and warmed up in {time.perf_counter() - started:.1f}s")
+
 def load_whisper_model():
     """Load Faster-Whisper model for voice processing"""
     global whisper_model
     
     try:
         # Get voice configuration from environment variables
-        voice_model = os.getenv("VOICE_MODEL", "tiny")  # tiny for speed, base for accuracy
+        voice_model = os.getenv("VOICE_MODEL", "tiny")  # tiny for speed, base for accuracy; distil-small.en for English-only
         voice_device = os.getenv("VOICE_DEVICE", "cuda")
+        # INT8 weights with FP16 activations on GPU, plain INT8 on CPU
+        voice_compute_type = os.getenv("VOICE_COMPUTE_TYPE", "int8_float16" if voice_device == "cuda" else "int8")
         
         print(f"🎤 Loading Faster-Whisper model: {voice_model}")
-        print(f"🔧 Voice device: {voice_device}")
+        print(f"🔧 Voice device: {voice_device} ({voice_compute_type})")
         
         # Load the Whisper model with environment configuration
-        whisper_model = WhisperModel(voice_model, device=voice_device, compute_type="float16")
+        from faster_whisper import WhisperModel
+        whisper_model = WhisperModel(voice_model, device=voice_device, compute_type=voice_compute_type)
         print("✅ Faster-Whisper model loaded successfully!")
         return True
         
@@ -410,7 +782,8 @@ def initialize_rag_system():
         # Get documents directory path
         documents_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'documents')
         
-        # Initialize RAG system
+        # Initialize RAG system (FAISS / sentence-transformers load only here)
+        from rag_system import MentalWellnessRAG
         rag_system = MentalWellnessRAG(documents_dir)
         
         if rag_system.initialize():
@@ -428,50 +801,284 @@ def initialize_rag_system():
         rag_system = None
         return False
 
-def classify_intent(message: str) -> Dict:
-    """Classify user message intent"""
-    message_lower = message.lower()
-    best_intent = "navigation"
-    best_confidence = 0.3
-    best_service = "navigation-assistance"
-    reasoning_parts = []
-    
-    for intent_name, config in INTENT_PATTERNS.items():
-        score = 0
-        matched_keywords = []
-        matched_patterns = []
-        
-        # Check keywords
-        for keyword in config["keywords"]:
-            if keyword in message_lower:
-                matched_keywords.append(keyword)
-                score += 1
-        
-        # Check patterns
-        for pattern in config["patterns"]:
-            if re.search(pattern, message_lower):
-                matched_patterns.append(pattern)
-                score += 2
-        
-        if score > 0:
-            confidence = min(config["confidence"], score * 0.2)
-            if confidence > best_confidence:
-                best_intent = intent_name
-                best_confidence = confidence
-                best_service = config["service"]
-                reasoning_parts = [
-                    f"Found {len(matched_keywords)} relevant keywords" if matched_keywords else "",
-                    f"Matched {len(matched_patterns)} patterns" if matched_patterns else ""
-                ]
-    
-    reasoning = "; ".join(filter(None, reasoning_parts)) or "Default classification"
+def run_generation(inputs: Dict, **generate_kwargs):
+    """Run model.generate without autograd, one call at a time"""
+    with generation_lock, torch.inference_mode():
+        return model.generate(**inputs, **generate_kwargs)
+
+class CancelledCriteria(StoppingCriteria):
+    """Stops a streamed generation once its client has gone away"""
     
-    return {
+    def __init__(self, cancel: threading.Event):
+        self.cancel = cancel
+    
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.cancel.is_set(), dtype=torch.bool, device=input_ids.device)
+
+async def run_in_inference_pool(func, *args, **kwargs):
+    """Await a blocking inference call without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_pool, functools.partial(func, *args, **kwargs))
+
+async def vllm_stream(prompt: str):
+    """Yield reply text pieces from the vLLM engine as they are decoded"""
+    sent = 0
+    async for output in vllm_model.generate(prompt, vllm_sampling_params, request_id=uuid.uuid4().hex):
+        text = output.outputs[0].text
+        yield text[sent:]
+        sent = len(text)
+
+async def vllm_generate(prompt: str) -> tuple:
+    """Generate one reply on the vLLM engine; returns (text, tokens_used)"""
+    final = None
+    async for output in vllm_model.generate(prompt, vllm_sampling_params, request_id=uuid.uuid4().hex):
+        final = output
+    return final.outputs[0].text.strip(), len(final.prompt_token_ids) + len(final.outputs[0].token_ids)
+
+def generate_batch(prompts: List[str]) -> List[tuple]:
+    """Generate replies for a batch of prompts; returns (text, tokens_used) per prompt"""
+    if llama_model is not None:
+        results = []
+        for prompt in prompts:
+            with generation_lock:
+                completion = llama_model(prompt, stop=["User:", "USER:"], **LLAMA_GENERATION_CONFIG)
+            results.append((completion["choices"][0]["text"].strip(), completion["usage"]["total_tokens"]))
+        return results
+    
+    inputs = tokenizer(
+        prompts,
+        return_tensors="pt",
+        truncation=True,
+        max_length=1024,
+        padding=True,
+        pad_to_multiple_of=PROMPT_LENGTH_BUCKET
+    ).to(device)
+    
+    outputs = run_generation(
+        {'input_ids': inputs['input_ids'], 'attention_mask': inputs['attention_mask']},
+        **GENERATION_CONFIG,
+        tokenizer=tokenizer,
+        pad_token_id=tokenizer.eos_token_id,
+        eos_token_id=tokenizer.eos_token_id
+    )
+    
+    # Prompts are left-padded to a common length, so new tokens start there
+    prompt_length = inputs['input_ids'].shape[1]
+    prompt_tokens = inputs['attention_mask'].sum(dim=1).tolist()
+    results = []
+    for row, new_tokens in enumerate(outputs[:, prompt_length:]):
+        new_tokens = new_tokens[new_tokens != tokenizer.eos_token_id]
+        text = tokenizer.decode(new_tokens, skip_special_tokens=True).strip()
+        results.append((text, int(prompt_tokens[row]) + len(new_tokens)))
+    return results
+
+class InferenceBatcher:
+    """Collects concurrent requests and runs them through batch_func as one batch
+    
+    batch_func takes a list of items and returns one result per item; it runs
+    in the inference pool.
+    """
+    
+    def __init__(self, batch_func, max_batch_size: int, max_latency_ms: int):
+        self.batch_func = batch_func
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.queue = asyncio.Queue()
+    
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+    
+    async def run(self):
+        """Drain the queue into batches of up to max_batch_size items"""
+        while True:
+            batch = [await self.queue.get()]
+            
+            # Give concurrent requests one window to join unless already full
+            if self.queue.qsize() < self.max_batch_size - 1:
+                await asyncio.sleep(self.max_latency)
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            
+            # Skip items whose callers already went away
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            
+            try:
+                results = await run_in_inference_pool(self.batch_func, [item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+async def build_chat_prompt(request: ChatRequest) -> tuple:
+    """Build the Phi-3 prompt (history + RAG context); returns (full_prompt, rag_context)"""
+    # Format conversation history - simple approach
+    conversation_history = ""
+    if request.conversation_history:
+        for msg in request.conversation_history[-3:]:  # Last 3 messages only
+            role = "User" if msg.get("role") == "user" else "Assistant"
+            conversation_history += f"{role}: {msg.get('content', '')}\n"
+    
+    # Get RAG context if available
+    rag_context = ""
+    if rag_system:
+        try:
+            # Detect context type for better RAG retrieval
+            found = {m.lastgroup for m in RAG_CONTEXT_PATTERN.finditer(request.message)}
+            context_type = next((t for t in RAG_CONTEXT_KEYWORDS if t in found), None)
+            
+            # Retrieve relevant context, batched with concurrent requests
+            rag_context = await retrieval_batcher.submit((request.message, context_type))
+            if rag_context:
+                logger.debug("📚 RAG Context Retrieved: %d characters", len(rag_context))
+            else:
+                logger.debug("📚 No relevant RAG context found")
+                
+        except Exception as e:
+            logger.warning("⚠️ RAG retrieval error: %s", e)
+            rag_context = ""
+    
+    # Create enhanced prompt with RAG context
+    if rag_context:
+        system_prompt = f"{CHAT_SYSTEM_PROMPT}\n\n{rag_context}\n{RAG_CONTEXT_INSTRUCTION}"
+    else:
+        system_prompt = CHAT_SYSTEM_PROMPT
+    
+    full_prompt = f"{system_prompt}\n\n{conversation_history}User: {request.message}\nAssistant:"
+    
+    return full_prompt, rag_context
+
+def run_llama_stream(prompt: str, pieces: queue.Queue, cancel: threading.Event):
+    """Producer thread for llama.cpp streaming; ends the queue with None"""
+    try:
+        with generation_lock:
+            for chunk in llama_model(prompt, stream=True, stop=["User:", "USER:"], **LLAMA_GENERATION_CONFIG):
+                if cancel.is_set():
+                    break
+                pieces.put(chunk["choices"][0]["text"])
+    except Exception as e:
+        logger.error("❌ Chat streaming error: %s", e)
+    finally:
+        pieces.put(None)
+
+def run_streamed_generation(inputs: Dict, streamer: TextIteratorStreamer, cancel: threading.Event):
+    """Producer thread for transformers streaming; always ends the streamer so the reader never hangs"""
+    try:
+        run_generation(
+            inputs,
+            **GENERATION_CONFIG,
+            streamer=streamer,
+            stopping_criteria=StoppingCriteriaList([CancelledCriteria(cancel)]),
+            tokenizer=tokenizer,
+            pad_token_id=tokenizer.eos_token_id,
+            eos_token_id=tokenizer.eos_token_id
+        )
+    except Exception as e:
+        logger.error("❌ Chat streaming error: %s", e)
+    finally:
+        streamer.end()
+
+def stream_generation(prompt: str, cancel: threading.Event):
+    """Yield reply text pieces as they are generated (runs in a worker thread)
+    
+    Generation runs in a producer thread under generation_lock; setting cancel
+    stops it at the next decode step.
+    """
+    if llama_model is not None:
+        pieces = queue.Queue()
+        threading.Thread(target=run_llama_stream, args=(prompt, pieces, cancel), daemon=True).start()
+        streamer = iter(pieces.get, None)
+    else:
+        # A single prompt only needs padding to reach a static-cache length bucket
+        inputs = tokenizer(
+            prompt,
+            return_tensors="pt",
+            truncation=True,
+            max_length=1024,
+            padding=PROMPT_LENGTH_BUCKET is not None,
+            pad_to_multiple_of=PROMPT_LENGTH_BUCKET
+        ).to(device)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        threading.Thread(target=run_streamed_generation, args=(inputs, streamer, cancel), daemon=True).start()
+    
+    # Stop at the first turn marker, holding back a tail that could be one
+    buffer = ""
+    for text in streamer:
+        buffer += text
+        for marker in ("User:", "USER:"):
+            if marker in buffer:
+                yield buffer.split(marker)[0]
+                return
+        safe_length = len(buffer) - len("USER:")
+        if safe_length > 0:
+            yield buffer[:safe_length]
+            buffer = buffer[safe_length:]
+    yield buffer
+
+def count_pattern_hits(message: str) -> Dict[str, int]:
+    """Count distinct intent patterns matched in a message, per intent"""
+    pattern_hits = dict.fromkeys(INTENT_PATTERNS, 0)
+    
+    if intent_pattern_db is not None:
+        def on_match(pattern_id, start, end, flags, context):
+            pattern_hits[INTENT_PATTERN_OWNERS[pattern_id]] += 1
+        intent_pattern_db.scan(message.encode(), match_event_handler=on_match)
+        return pattern_hits
+    
+    if not COMBINED_INTENT_PATTERN.search(message):
+        return pattern_hits
+    for intent_name, matcher in INTENT_PATTERN_MATCHERS:
+        if matcher.search(message):
+            pattern_hits[intent_name] += 1
+    return pattern_hits
+
+@functools.lru_cache(maxsize=4096)
+def classify_intent(message: str) -> Mapping:
+    """Classify user message intent (results are cached per message and read-only)"""
+    if CRISIS_PATTERN.search(message):
+        return CRISIS_INTENT_RESULT
+    
+    # Single pass for all keywords; each distinct keyword counts once
+    keyword_hits = dict.fromkeys(INTENT_PATTERNS, 0)
+    for keyword in {m.group(1).lower() for m in COMBINED_KEYWORD_PATTERN.finditer(message)}:
+        keyword_hits[INTENT_KEYWORDS[keyword]] += 1
+    
+    # Single pass for all patterns; each distinct pattern counts once
+    pattern_hits = count_pattern_hits(message)
+    
+    if not any(keyword_hits.values()) and not any(pattern_hits.values()):
+        return DEFAULT_INTENT_RESULT
+    
+    # Score all intents from the hit counts in one pass (first intent wins ties)
+    confidences = {
+        intent_name: min(config["confidence"], (keyword_hits[intent_name] + 2 * pattern_hits[intent_name]) * 0.2)
+        for intent_name, config in INTENT_PATTERNS.items()
+    }
+    best_intent = max(confidences, key=confidences.get)
+    best_confidence = confidences[best_intent]
+    if best_confidence <= DEFAULT_INTENT_RESULT["confidence"]:
+        return DEFAULT_INTENT_RESULT
+    
+    matched_keywords = keyword_hits[best_intent]
+    matched_patterns = pattern_hits[best_intent]
+    reasoning_parts = [
+        f"Found {matched_keywords} relevant keywords" if matched_keywords else "",
+        f"Matched {matched_patterns} patterns" if matched_patterns else ""
+    ]
+    
+    return MappingProxyType({
         "intent": best_intent,
         "confidence": round(best_confidence, 2),
-        "suggested_service": best_service,
-        "reasoning": reasoning
-    }
+        "suggested_service": INTENT_PATTERNS[best_intent]["service"],
+        "reasoning": "; ".join(filter(None, reasoning_parts))
+    })
 
 def process_audio_file(audio_file_path: str, language: str = "auto") -> Dict:
     """Process uploaded audio file with Faster-Whisper"""
@@ -479,13 +1086,15 @@ def process_audio_file(audio_file_path: str, language: str = "auto") -> Dict:
         raise HTTPException(status_code=503, detail="Voice processing unavailable - Whisper model not loaded")
     
     try:
-        print(f"🎤 Transcribing audio file: {audio_file_path}")
+        logger.debug("🎤 Transcribing audio file: %s", audio_file_path)
         
-        # Use Faster-Whisper to transcribe
-        if language == "auto":
-            segments, info = whisper_model.transcribe(audio_file_path)
-        else:
-            segments, info = whisper_model.transcribe(audio_file_path, language=language)
+        # Use Faster-Whisper to transcribe; greedy decoding and the Silero VAD
+        # filter (skips silence) favour chat latency over the last bit of WER
+        segments, info = whisper_model.transcribe(
+            audio_file_path,
+            language=None if language == "auto" else language,
+            **WHISPER_TRANSCRIBE_CONFIG
+        )
         
         # Combine all segments into full transcription
         transcription = " ".join(segment.text for segment in segments)
@@ -502,11 +1111,55 @@ def process_audio_file(audio_file_path: str, language: str = "auto") -> Dict:
         }
         
     except Exception as e:
-        print(f"❌ Error processing audio: {e}")
+        logger.error("❌ Error processing audio: %s", e)
         raise HTTPException(status_code=500, detail=f"Audio processing failed: {str(e)}")
 
 # Emotion analysis removed for faster processing
 
+def get_charts_dir():
+    """Get the rendered chart directory from environment variable"""
+    charts_dir_env = os.getenv("CHARTS_DIR", "static/charts")
+    
+    # If relative path, make it relative to project root
+    if not os.path.isabs(charts_dir_env):
+        project_root = os.path.join(os.path.dirname(__file__), '..', '..')
+        charts_dir = os.path.join(project_root, charts_dir_env)
+    else:
+        charts_dir = charts_dir_env
+    
+    os.makedirs(charts_dir, exist_ok=True)
+    return charts_dir
+
+def get_chart_filename(key: tuple) -> str:
+    """Unguessable, deterministic file name for a chart cache key"""
+    digest = hashlib.blake2b(repr(key).encode(), key=chart_url_key, digest_size=16).hexdigest()
+    return f"{digest}.png"
+
+def write_chart_file(path: str, png_bytes: bytes):
+    """Write a chart PNG atomically so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(png_bytes)
+    os.replace(tmp_path, path)
+
+def evict_old_charts():
+    """Keep only the CHART_CACHE_SIZE most recently used chart files"""
+    with os.scandir(CHARTS_DIR) as it:
+        entries = [entry for entry in it if entry.name.endswith('.png')]
+    if len(entries) <= CHART_CACHE_SIZE:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:-CHART_CACHE_SIZE]:
+        try:
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+
+async def generate_mood_chart(mood_data: List[dict]) -> bytes:
+    """Render mood history to PNG bytes off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(chart_pool, generate_mood_chart_bytes, mood_data)
+
 # =============================================
 # LIFESPAN EVENT HANDLER
 # =============================================
@@ -516,15 +1169,30 @@ from contextlib import asynccontextmanager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize and cleanup services"""
+    global chart_pool, inference_pool, generation_batcher, retrieval_batcher
     print("🚀 Starting Mental Wellness Platform API...")
+    chart_pool = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1), mp_context=CHART_POOL_CONTEXT)
+    inference_pool = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
     initialize_database()
     load_phi3_model()
     load_whisper_model()
     initialize_langchain()
     initialize_rag_system()
+    generation_batcher = InferenceBatcher(generate_batch, GENERATION_BATCH_SIZE, GENERATION_BATCH_WINDOW_MS)
+    retrieval_batcher = InferenceBatcher(
+        lambda queries: rag_system.get_rag_response_context_batch(queries), RAG_BATCH_SIZE, RAG_BATCH_WINDOW_MS
+    )
+    batcher_tasks = [
+        asyncio.create_task(generation_batcher.run()),
+        asyncio.create_task(retrieval_batcher.run())
+    ]
     print("✅ All services initialized successfully!")
     yield
     print("🔄 Shutting down Mental Wellness Platform API...")
+    for task in batcher_tasks:
+        task.cancel()
+    chart_pool.shutdown(wait=False, cancel_futures=True)
+    inference_pool.shutdown(wait=False, cancel_futures=True)
 
 # Update app initialization to use lifespan
 app = FastAPI(
@@ -534,6 +1202,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Serve rendered mood charts as cacheable static files
+CHARTS_DIR = get_charts_dir()
+app.mount("/charts", StaticFiles(directory=CHARTS_DIR), name="charts")
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -552,9 +1224,8 @@ async def health_check():
     """Overall system health check"""
     try:
         # Check database
-        conn = get_db_connection()
-        conn.execute("SELECT 1")
-        conn.close()
+        with get_db_connection() as conn:
+            conn.execute("SELECT 1")
         db_status = "connected"
     except Exception:
         db_status = "error"
@@ -564,8 +1235,8 @@ async def health_check():
         "service": "unified-wellness-api",
         "components": {
             "database": db_status,
-            "llm_model": "loaded" if model is not None else "template_only",
-            "cuda_available": torch.cuda.is_available(),
+            "llm_model": "loaded" if llm_loaded() else "template_only",
+            "cuda_available": CUDA_AVAILABLE,
             "matplotlib": "available"
         },
         "timestamp": datetime.now().isoformat()
@@ -575,117 +1246,78 @@ async def health_check():
 # LLM ENDPOINTS
 # =============================================
 
+async def generate_chat_reply(request: ChatRequest) -> ChatResponse:
+    """Build the prompt and generate one reply; shared by the text and voice chat endpoints"""
+    full_prompt, rag_context = await build_chat_prompt(request)
+    
+    # Generate response (batched with concurrent requests, off the event loop)
+    if vllm_model is not None:
+        response, tokens_used = await vllm_generate(full_prompt)
+    else:
+        response, tokens_used = await generation_batcher.submit(full_prompt)
+    
+    # Clean up response
+    response = response.split("USER:")[0].split("User:")[0].strip()
+    
+    if not response or len(response) < 10:
+        raise ValueError("Generated response too short or empty")
+    
+    # Log response with RAG status
+    rag_status = "with RAG context" if rag_context else "without RAG context"
+    logger.info("✅ Response Generated (%s) | Length: %d", rag_status, len(response))
+    
+    # Determine model name based on RAG usage
+    model_name = "phi-3-mini-4k-instruct-rag" if rag_context else "phi-3-mini-4k-instruct"
+    
+    return ChatResponse(
+        response=response,
+        confidence=0.95,
+        model_used=model_name,
+        tokens_used=tokens_used
+    )
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat_with_llm(request: ChatRequest):
     """Chat with Phi-3-mini LLM - Enhanced with Model Context Protocol (MCP)"""
-    global tokenizer, model, device, conversation_chain
-    
     # Ensure model is loaded
-    if model is None or tokenizer is None:
+    if not llm_loaded():
         raise HTTPException(status_code=503, detail="Phi-3-mini model not loaded. Server startup failed.")
     
     try:
-        # Format conversation history - simple approach
-        conversation_history = ""
-        if request.conversation_history:
-            for msg in request.conversation_history[-3:]:  # Last 3 messages only
-                role = "User" if msg.get("role") == "user" else "Assistant"
-                conversation_history += f"{role}: {msg.get('content', '')}\n"
-        
-        # Get RAG context if available
-        rag_context = ""
-        if rag_system:
-            try:
-                # Detect context type for better RAG retrieval
-                context_type = None
-                message_lower = request.message.lower()
-                if any(word in message_lower for word in ["anxious", "anxiety", "worry", "panic"]):
-                    context_type = "anxiety"
-                elif any(word in message_lower for word in ["sad", "depressed", "depression", "hopeless"]):
-                    context_type = "depression"
-                elif any(word in message_lower for word in ["stress", "overwhelmed", "pressure"]):
-                    context_type = "stress"
-                elif any(word in message_lower for word in ["mindful", "meditation", "breathing"]):
-                    context_type = "therapy"
-                
-                # Retrieve relevant context
-                rag_context = rag_system.get_rag_response_context(request.message, context_type)
-                if rag_context:
-                    print(f"📚 RAG Context Retrieved: {len(rag_context)} characters")
-                else:
-                    print("📚 No relevant RAG context found")
-                    
-            except Exception as e:
-                print(f"⚠️ RAG retrieval error: {e}")
-                rag_context = ""
-        
-        # Create enhanced prompt with RAG context
-        system_prompt = "You are a friendly mental wellness companion. Respond naturally and helpfully."
-        
-        if rag_context:
-            system_prompt += f"\n\n{rag_context}\nUse this information to provide more helpful and accurate responses, but keep your response conversational and natural."
-        
-        if conversation_history:
-            full_prompt = f"{system_prompt}\n\n{conversation_history}User: {request.message}\nAssistant:"
-        else:
-            full_prompt = f"{system_prompt}\n\nUser: {request.message}\nAssistant:"
-
-        # Tokenize input
-        inputs = tokenizer(
-            full_prompt, 
-            return_tensors="pt", 
-            truncation=True, 
-            max_length=1024,
-            padding=True
-        )
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        # Generate response with optimized parameters
-        with torch.no_grad():
-            outputs = model.generate(
-                input_ids=inputs['input_ids'],
-                attention_mask=inputs.get('attention_mask'),
-                max_new_tokens=200,
-                temperature=0.8,
-                do_sample=True,
-                top_p=0.95,
-                top_k=50,
-                repetition_penalty=1.1,
-                pad_token_id=tokenizer.eos_token_id,
-                eos_token_id=tokenizer.eos_token_id,
-                use_cache=False  # Fix for DynamicCache compatibility
-            )
-        
-        # Decode and clean response
-        full_response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        
-        # Extract only the new response
-        response = full_response[len(full_prompt):].strip()
-        
-        # Clean up response
-        response = response.split("USER:")[0].split("User:")[0].strip()
-        
-        if not response or len(response) < 10:
-            raise ValueError("Generated response too short or empty")
-        
-        # Log response with RAG status
-        rag_status = "with RAG context" if rag_context else "without RAG context"
-        print(f"✅ Response Generated ({rag_status}) | Length: {len(response)}")
-        
-        # Determine model name based on RAG usage
-        model_name = "phi-3-mini-4k-instruct-rag" if rag_context else "phi-3-mini-4k-instruct"
-        
-        return ChatResponse(
-            response=response,
-            confidence=0.95,
-            model_used=model_name,
-            tokens_used=len(outputs[0])
-        )
+        return await generate_chat_reply(request)
             
     except Exception as e:
-        print(f"❌ Chat generation error: {e}")
+        logger.error("❌ Chat generation error: %s", e)
         raise HTTPException(status_code=500, detail=f"Phi-3-mini chat generation failed: {str(e)}")
 
+@app.post("/api/chat/stream")
+async def chat_with_llm_stream(request: ChatRequest):
+    """Stream the Phi-3-mini reply as server-sent events, one text piece per event"""
+    if not llm_loaded():
+        raise HTTPException(status_code=503, detail="Phi-3-mini model not loaded. Server startup failed.")
+    
+    full_prompt, _ = await build_chat_prompt(request)
+    cancel = threading.Event()
+    
+    async def event_stream():
+        try:
+            if vllm_model is not None:
+                pieces = vllm_stream(full_prompt)
+            else:
+                pieces = iterate_in_threadpool(stream_generation(full_prompt, cancel))
+            async for text in pieces:
+                if text:
+                    yield f"data: {json.dumps({'token': text})}\n\n"
+        except Exception as e:
+            logger.error("❌ Chat streaming error: %s", e)
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            # Reply finished or client disconnected: stop the generation thread
+            cancel.set()
+        yield "data: [DONE]\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 # =============================================
 # INTENT CLASSIFICATION ENDPOINTS
 # =============================================
@@ -707,23 +1339,15 @@ async def classify_message_intent(request: IntentRequest):
 async def record_mood(mood_entry: MoodEntry):
     """Record a mood entry"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO mood_history (user_id, mood_score, session_type, feedback_text, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            mood_entry.user_id,
-            mood_entry.mood_score,
-            mood_entry.session_type,
-            mood_entry.feedback_text,
-            datetime.now().isoformat()
-        ))
-        
-        conn.commit()
-        mood_id = cursor.lastrowid
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.execute(INSERT_MOOD_SQL, (
+                mood_entry.user_id,
+                mood_entry.mood_score,
+                mood_entry.session_type,
+                mood_entry.feedback_text,
+                datetime.now().isoformat()
+            ))
+            mood_id = cursor.lastrowid
         
         return {
             "success": True,
@@ -733,60 +1357,90 @@ async def record_mood(mood_entry: MoodEntry):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to record mood: {str(e)}")
 
-@app.get("/api/analytics/{user_id}", response_model=AnalyticsResponse)
-async def get_user_analytics(user_id: int, days: int = 30):
-    """Get user analytics and mood trends"""
+@app.post("/api/mood/record_batch")
+async def record_mood_batch(batch: MoodEntryBatch):
+    """Record multiple mood entries in a single transaction"""
     try:
-        conn = get_db_connection()
-        
-        cutoff_date = datetime.now() - timedelta(days=days)
-        
-        cursor = conn.execute("""
-            SELECT mood_score, session_type, timestamp, feedback_text
-            FROM mood_history 
-            WHERE user_id = ? AND datetime(timestamp) >= datetime(?)
-            ORDER BY timestamp ASC
-        """, (user_id, cutoff_date.isoformat()))
-        
-        mood_data = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        if not mood_data:
-            return AnalyticsResponse(
-                user_id=user_id,
-                average_mood=50.0,
-                mood_trend="no_data",
-                total_sessions=0,
-                mood_data=[],
-                chart_url=None
-            )
+        now_iso = datetime.now().isoformat()
+        rows = [
+            (entry.user_id, entry.mood_score, entry.session_type, entry.feedback_text, now_iso)
+            for entry in batch.entries
+        ]
+        
+        with get_db_connection() as conn:
+            # Pooled connections autocommit, so open the transaction explicitly
+            conn.execute("BEGIN")
+            with conn:
+                conn.executemany(INSERT_MOOD_SQL, rows)
         
-        # Calculate analytics
-        scores = [entry['mood_score'] for entry in mood_data]
-        average_mood = sum(scores) / len(scores)
-        total_sessions = len(mood_data)
+        return {
+            "success": True,
+            "recorded": len(rows),
+            "message": "Mood entries recorded successfully"
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to record mood batch: {str(e)}")
+
+@app.get("/api/analytics/{user_id}", response_model=AnalyticsResponse)
+async def get_user_analytics(response: Response, background_tasks: BackgroundTasks, user_id: int, days: int = 30, include_raw: bool = False, include_chart: bool = False):
+    """Get user analytics and mood trends (raw entries / chart only when requested)"""
+    try:
+        params = (user_id, f"-{int(days)} days")
         
-        # Determine trend
-        if len(scores) > 1:
-            recent_avg = sum(scores[-7:]) / min(7, len(scores))
-            older_avg = sum(scores[:-7]) / max(1, len(scores) - 7) if len(scores) > 7 else average_mood
+        with get_db_connection() as conn:
+            # Aggregate in SQLite over the (user_id, timestamp) index range
+            average_mood, total_sessions, last_mood_id, recent_avg, older_avg = conn.execute(MOOD_SUMMARY_SQL, params).fetchone()
+            
+            if total_sessions == 0:
+                return AnalyticsResponse(
+                    user_id=user_id,
+                    average_mood=50.0,
+                    mood_trend="no_data",
+                    total_sessions=0,
+                    mood_data=[],
+                    chart_url=None
+                )
             
-            if recent_avg > older_avg + 5:
-                trend = "improving"
-            elif recent_avg < older_avg - 5:
-                trend = "declining"
+            # Determine trend: last 7 entries vs. everything before them
+            if total_sessions > 1:
+                if total_sessions <= 7:
+                    older_avg = average_mood
+                
+                if recent_avg > older_avg + 5:
+                    trend = "improving"
+                elif recent_avg < older_avg - 5:
+                    trend = "declining"
+                else:
+                    trend = "stable"
             else:
-                trend = "stable"
-        else:
-            trend = "insufficient_data"
+                trend = "insufficient_data"
+            
+            chart_name = get_chart_filename((user_id, days, last_mood_id, total_sessions))
+            chart_path = os.path.join(CHARTS_DIR, chart_name)
+            chart_cached = include_chart and os.path.exists(chart_path)
+            
+            mood_data = []
+            if include_raw or (include_chart and not chart_cached):
+                cursor = conn.execute(MOOD_DATA_SQL, params)
+                mood_data = [dict(row) for row in cursor.fetchall()]
+        
+        chart_url = None
+        if include_chart:
+            if chart_cached:
+                os.utime(chart_path)  # Mark as recently used for eviction
+            else:
+                write_chart_file(chart_path, await generate_mood_chart(mood_data))
+                background_tasks.add_task(evict_old_charts)
+            chart_url = f"/charts/{chart_name}"
+            response.headers["Cache-Control"] = "private, max-age=60"
         
         return AnalyticsResponse(
             user_id=user_id,
             average_mood=round(average_mood, 2),
             mood_trend=trend,
             total_sessions=total_sessions,
-            mood_data=mood_data,
-            chart_url=None  # Chart generation can be added later if needed
+            mood_data=mood_data if include_raw else [],
+            chart_url=chart_url
         )
         
     except Exception as e:
@@ -809,7 +1463,7 @@ async def transcribe_audio(
     Language can be 'auto' for auto-detection or specific language codes (en, es, fr, etc.)
     """
     
-    print(f"🎤 Voice transcription request: file={audio_file.filename}, user_id={user_id}, language={language}")
+    logger.info("🎤 Voice transcription request: file=%s, user_id=%s, language=%s", audio_file.filename, user_id, language)
     
     if whisper_model is None:
         raise HTTPException(
@@ -827,40 +1481,50 @@ async def transcribe_audio(
             detail=f"Unsupported audio format. Allowed: {', '.join(allowed_formats)}"
         )
     
+    # Reject oversized uploads before copying them or running Whisper
+    if audio_file.size is not None and audio_file.size > MAX_AUDIO_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Audio file too large. Maximum size: {MAX_AUDIO_UPLOAD_BYTES // (1024 * 1024)} MB"
+        )
+    
     # Create temporary file to store uploaded audio
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-        try:
-            # Save uploaded file
-            content = await audio_file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-            
-            print(f"🎤 Processing audio file: {audio_file.filename} ({len(content)} bytes)")
-            
-            # Process audio with Whisper
-            result = process_audio_file(temp_file_path, language)
-            
-            # Set estimated duration (faster than calculating)
-            result["duration"] = len(content) / 16000.0  # Rough estimate
-            
-            # Skip database storage for voice transcriptions - not needed
-            
-            print(f"✅ Audio transcribed successfully: '{result['transcription'][:50]}...'")
-            
-            return VoiceTranscriptionResponse(**result)
-            
-        except HTTPException:
-            raise
-        except Exception as e:
-            print(f"❌ Voice transcription error: {e}")
-            raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension)
+    temp_file_path = temp_file.name
+    try:
+        # Stream the upload to disk in chunks, off the event loop; closing
+        # flushes it before Whisper opens the path
+        with temp_file:
+            await run_in_threadpool(shutil.copyfileobj, audio_file.file, temp_file, UPLOAD_CHUNK_SIZE)
+            content_length = temp_file.tell()
         
-        finally:
-            # Clean up temporary file
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+        logger.debug("🎤 Processing audio file: %s (%d bytes)", audio_file.filename, content_length)
+        
+        # Process audio with Whisper on the GPU worker (segments decode lazily, so the
+        # whole call runs there) instead of blocking the event loop
+        result = await run_in_inference_pool(process_audio_file, temp_file_path, language)
+        
+        # Set estimated duration (faster than calculating)
+        result["duration"] = content_length / 16000.0  # Rough estimate
+        
+        # Skip database storage for voice transcriptions - not needed
+        
+        logger.debug("✅ Audio transcribed successfully: '%.50s...'", result['transcription'])
+        
+        return VoiceTranscriptionResponse(**result)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("❌ Voice transcription error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
+    
+    finally:
+        # Clean up temporary file
+        try:
+            os.unlink(temp_file_path)
+        except:
+            pass
 
 @app.post("/api/voice/chat")
 async def voice_chat(
@@ -872,6 +1536,10 @@ async def voice_chat(
     Complete voice-to-voice workflow: transcribe audio, process with LLM, return text response
     """
     
+    # Fail before transcribing if there is no model to answer with
+    if not llm_loaded():
+        raise HTTPException(status_code=503, detail="Phi-3-mini model not loaded. Server startup failed.")
+    
     # First transcribe the audio
     transcription_response = await transcribe_audio(audio_file, user_id, language)
     
@@ -883,9 +1551,9 @@ async def voice_chat(
         context=f"Voice message (emotional tone: {transcription_response.emotional_tone})"
     )
     
-    # Get LLM response using the existing chat endpoint function
+    # Get LLM response from the shared chat helper
     try:
-        chat_response = await chat_with_llm(chat_request)
+        chat_response = await generate_chat_reply(chat_request)
         
         return {
             "transcription": transcription_response,
@@ -893,7 +1561,7 @@ async def voice_chat(
             "processing_time": f"{transcription_response.duration + 2.0:.2f}s"  # Estimate
         }
     except Exception as e:
-        print(f"❌ Voice chat error: {e}")
+        logger.error("❌ Voice chat error: %s", e)
         raise HTTPException(status_code=500, detail=f"Voice chat failed: {str(e)}")
 
 # =============================================
@@ -70,6 +70,7 @@ CREATE INDEX IF NOT EXISTS idx_conversations_session_type ON conversations(sessi
 CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
 CREATE INDEX IF NOT EXISTS idx_mood_history_user_id ON mood_history(user_id);
 CREATE INDEX IF NOT EXISTS idx_mood_history_date ON mood_history(recorded_at);
+CREATE INDEX IF NOT EXISTS idx_mood_history_user_date ON mood_history(user_id, recorded_at);
 CREATE INDEX IF NOT EXISTS idx_session_analytics_user_date ON session_analytics(user_id, session_date);
 
 -- Insert sample data for testing
@@ -16,4 +16,10 @@ if ($LASTEXITCODE -ne 0) {
 # Start unified API
 Write-Host "Starting Unified API with Phi-3-mini..." -ForegroundColor Green
 Set-Location "services\python"
-python unified_api.py
\ No newline at end of file
+# Serve through uvicorn so multiprocessing workers (spawn on Windows) import
+# uvicorn's small __main__ rather than re-running unified_api.py with torch
+$apiHost = if ($env:HOST) { $env:HOST } else { "0.0.0.0" }
+$apiPort = if ($env:PORT) { $env:PORT } else { "8000" }
+$logLevel = if ($env:LOG_LEVEL) { $env:LOG_LEVEL.ToLower() } else { "info" }
+$reloadArgs = if ($env:DEBUG -eq "false") { @() } else { @("--reload") }
+python -m uvicorn unified_api:app --host $apiHost --port $apiPort --log-level $logLevel @reloadArgs
\ No newline at end of file